@@ -0,0 +1,75 @@
+"""
+Run the full bot pipeline against recorded fixtures and report per stage timings
+and throughput. Output files are written to a new temporary directory per run.
+
+    python -m benchmarks.pipeline --fixtures benchmarks/fixtures/sweden_hot.json --runs 3
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import torch
+from bot import load_models, run_cycle
+from src.cache import PredictionCache, get_model_revision
+from src.fake_reddit import FakeReddit, load_fixtures
+from src.timing import StageTimer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", default="benchmarks/fixtures/sweden_hot.json")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--fetch-workers", type=int, default=4)
+    parser.add_argument(
+        "--cache", action="store_true", help="Use the prediction cache (warm after first run)."
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Keep state between runs: later runs only analyze comments changed since (none).",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    fixtures = load_fixtures(args.fixtures)
+
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    start = time.perf_counter()
+    models = load_models(device)
+    print(f"Loaded models in {time.perf_counter() - start:.2f}s")
+
+    os.chdir(tempfile.mkdtemp(prefix="sprakpolisen_bench_"))
+    cache = None
+    if args.cache:
+        cache = PredictionCache(model_revision=get_model_revision(models["pipe"]))
+
+    for run in range(args.runs):
+        if run > 0 and not args.delta:
+            # Fresh reply history and snapshots, so that every run does the same work
+            os.chdir(tempfile.mkdtemp(prefix="sprakpolisen_bench_"))
+
+        reddit = FakeReddit(fixtures)
+        timer = StageTimer()
+
+        try:
+            run_cycle(
+                reddit,
+                models,
+                device=device,
+                cache=cache,
+                fetch_workers=args.fetch_workers,
+                timer=timer,
+                delta=args.delta,
+            )
+        except AssertionError:
+            print("No reply candidate found.")
+
+        print(f"\nRun {run + 1}/{args.runs} ({len(reddit.replies)} replies)")
+        print(timer.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Scaling of comment preprocessing (sentence splitting, de/dem filtering and text cleaning)
+with the number of worker processes, on a corpus made by repeating the fixture comments.
+--batch-rows preprocesses the corpus in batches of that many comments, as the bot does
+per pipeline batch (see run_cycle), instead of in one call.
+
+    python -m benchmarks.preprocess --workers 1 2 4 8 --repeat 200 --batch-rows 100
+"""
+
+import time
+import argparse
+import pandas as pd
+from src.data import create_preprocess_pool, filter_dedem_comments, preprocess_comments
+from src.fake_reddit import load_fixtures
+
+
+def load_corpus(fixtures_path, repeat):
+    bodies = [
+        comment["body"]
+        for submission in load_fixtures(fixtures_path)["submissions"]
+        for comment in submission.get("comments", [])
+        if comment.get("body") is not None
+    ]
+    df = pd.DataFrame({"body": bodies * repeat})
+    return filter_dedem_comments(df)
+
+
+def preprocess_batches(df, pool, batch_rows):
+    if batch_rows is None:
+        return preprocess_comments(df, executor=pool)
+
+    batches = [df.iloc[i : i + batch_rows] for i in range(0, len(df), batch_rows)]
+    return pd.concat(
+        [preprocess_comments(batch, executor=pool) for batch in batches], ignore_index=True
+    )
+
+
+def run(df, workers, runs, batch_rows=None):
+    pool = create_preprocess_pool(workers)
+    try:
+        if pool is not None:
+            preprocess_comments(df.head(workers * 16), executor=pool)  # Start the workers
+
+        start = time.perf_counter()
+        for _ in range(runs):
+            df_out = preprocess_batches(df, pool, batch_rows)
+        return (time.perf_counter() - start) / runs, df_out
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", default="benchmarks/fixtures/sweden_hot.json")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--batch-rows", type=int, default=None)
+    args = parser.parse_args()
+
+    df = load_corpus(args.fixtures, args.repeat)
+    print(f"{len(df)} comments with de/dem")
+
+    seconds_serial = None
+    sentences_serial = None
+    for workers in args.workers:
+        seconds, df_out = run(df, workers, args.runs, batch_rows=args.batch_rows)
+        if seconds_serial is None:
+            seconds_serial, sentences_serial = seconds, df_out["sentences"].tolist()
+
+        identical = df_out["sentences"].tolist() == sentences_serial
+        print(
+            f"{workers:>3} workers: {seconds:7.3f}s, {len(df) / seconds:9.0f} comments/s, "
+            f"speedup {seconds_serial / seconds:5.2f}x, output identical: {identical}"
+        )
+
+
+if __name__ == "__main__":
+    main()
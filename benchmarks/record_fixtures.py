@@ -0,0 +1,26 @@
+"""
+Record hot submissions and their comments from the live reddit API to a fixture file
+that can be replayed with src.fake_reddit.FakeReddit.
+
+    python -m benchmarks.record_fixtures --out benchmarks/fixtures/sweden_hot.json
+"""
+
+import argparse
+from bot import get_reddit
+from src.fake_reddit import record_fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--out", default="benchmarks/fixtures/sweden_hot.json")
+    parser.add_argument("--subreddit", default="sweden")
+    parser.add_argument("--limit", type=int, default=35)
+    args = parser.parse_args()
+
+    fixtures = record_fixtures(get_reddit(), args.out, subreddit=args.subreddit, limit=args.limit)
+    n_comments = sum(len(sub["comments"]) for sub in fixtures["submissions"])
+    print(f"Recorded {len(fixtures['submissions'])} submissions and {n_comments} comments.")
+
+
+if __name__ == "__main__":
+    main()
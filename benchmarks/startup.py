@@ -0,0 +1,58 @@
+"""
+Measure bot startup cost in fresh interpreters: module imports, DeFormer loading and the
+parts that are deferred until needed (plotting libraries, translation model).
+
+    python -m benchmarks.startup --runs 3
+"""
+
+import sys
+import argparse
+import statistics
+import subprocess
+
+STAGES = {
+    "import bot": "import bot",
+    "import src.translate": "import src.translate",
+    "import matplotlib.pyplot (deferred)": "import matplotlib.pyplot",
+    "load_models": "import bot, torch; bot.load_models(torch.device('cpu'))",
+    "load_models + load_translation (deferred)": (
+        "import bot, torch; device = torch.device('cpu'); "
+        "bot.load_translation(bot.load_models(device), device)"
+    ),
+}
+
+
+def time_statement(statement, runs):
+    """
+    Median wall clock time of running a statement in a new Python process.
+    """
+    code = (
+        f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    )
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    timings = {}
+    for name, statement in STAGES.items():
+        timings[name] = time_statement(statement, args.runs)
+        print(f"{name:<45} {timings[name]:7.2f}s")
+
+    deferred = timings["load_models + load_translation (deferred)"] - timings["load_models"]
+    print(f"\nSaved on runs without a reply candidate: {deferred:.2f}s (translation model)")
+    print(f"Saved on every run: {timings['import matplotlib.pyplot (deferred)']:.2f}s (matplotlib)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare CPU latency and de/dem -> they/them alignment of the fp32 and the dynamic int8
+quantized translation model.
+
+    python -m benchmarks.translation --runs 5
+"""
+
+import re
+import time
+import argparse
+import pandas as pd
+import torch
+from src.onnx_backend import PARITY_SENTENCES
+from src.translate import load_translation_model, translation_preprocess
+
+
+def make_post(sentence):
+    """
+    A df_post with every de/dem in the sentence predicted as incorrect.
+    """
+    pred = [
+        {
+            "entity": "DEM" if match.group().lower() == "de" else "DE",
+            "score": 0.99,
+            "word": match.group().lower(),
+            "start": match.start(),
+            "end": match.end(),
+        }
+        for match in re.finditer(r"(?<!\w)[Dd][Ee][Mm]?(?!\w)", sentence)
+    ]
+    return pd.DataFrame({"pred": [[pred]], "sentences": [[sentence]]})
+
+
+def run(model_translate, tokenizer_translate, posts, runs):
+    device = torch.device("cpu")
+    alignments = []
+    start = time.perf_counter()
+
+    for _ in range(runs):
+        alignments = []
+        for df_post in posts:
+            try:
+                with torch.no_grad():
+                    sv_pipe, en_pipe = translation_preprocess(
+                        df_post, model_translate, tokenizer_translate, device
+                    )
+            except KeyError:
+                # de/dem could not be matched to a translation tokenizer token
+                alignments.append(None)
+                continue
+            alignments.append([token["word"] for token in en_pipe["pred_pipe"][0]])
+
+    return (time.perf_counter() - start) / (runs * len(posts)), alignments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="Helsinki-NLP/opus-mt-sv-en")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    posts = [make_post(sentence) for sentence in PARITY_SENTENCES]
+
+    model_fp32, tokenizer = load_translation_model(args.model, quantize=False)
+    model_int8, _ = load_translation_model(args.model, quantize=True)
+
+    latency_fp32, align_fp32 = run(model_fp32, tokenizer, posts, args.runs)
+    latency_int8, align_int8 = run(model_int8, tokenizer, posts, args.runs)
+
+    agreement = sum(a == b for a, b in zip(align_fp32, align_int8)) / len(posts)
+    print(f"fp32: {latency_fp32 * 1000:.1f} ms/post")
+    print(f"int8: {latency_int8 * 1000:.1f} ms/post ({latency_fp32 / latency_int8:.2f}x)")
+    print(f"Alignment agreement: {agreement:.2%} of {len(posts)} posts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compare full sentence inference with candidate window inference (CandidateWindowPipe)
+for a range of window sizes: latency and agreement of the actionable predictions.
+
+    python -m benchmarks.windowing --windows 4 8 16 32 --runs 3
+"""
+
+import time
+import argparse
+import torch
+from nltk.tokenize import sent_tokenize
+from bot import load_models
+from src.data import filter_dedem_sentences
+from src.fake_reddit import load_fixtures
+from src.inference import (
+    CANDIDATE_PATTERN,
+    CandidateWindowPipe,
+    keep_mismatches,
+    normalize_sentence,
+    predict_sentences,
+)
+from src.onnx_backend import PARITY_SENTENCES
+
+
+def load_sentences(fixtures_path):
+    sentences = list(PARITY_SENTENCES)
+    for submission in load_fixtures(fixtures_path)["submissions"]:
+        for comment in submission.get("comments", []):
+            sentences += filter_dedem_sentences(sent_tokenize(comment["body"], language="swedish"))
+
+    return [normalize_sentence(sentence) for sentence in sentences]
+
+
+def run(pipe, sentences, runs, batch_size):
+    start = time.perf_counter()
+    for _ in range(runs):
+        preds = predict_sentences(sentences, pipe, batch_size=batch_size)
+    return (time.perf_counter() - start) / runs, preds
+
+
+def compare(preds_ref, preds_test, threshold):
+    """
+    Share of sentences with identical actionable predictions, and share of candidate
+    tokens (de/dem/det/...) with the same label.
+    """
+    n_sentence_agree = 0
+    n_candidates = 0
+    n_label_agree = 0
+
+    for pred_ref, pred_test in zip(preds_ref, preds_test):
+        actionable_ref = [
+            (d["start"], d["entity"]) for d in keep_mismatches(pred_ref) if d["score"] > threshold
+        ]
+        actionable_test = [
+            (d["start"], d["entity"]) for d in keep_mismatches(pred_test) if d["score"] > threshold
+        ]
+        n_sentence_agree += actionable_ref == actionable_test
+
+        labels_test = {d["start"]: d["entity"] for d in pred_test}
+        for d in pred_ref:
+            if CANDIDATE_PATTERN.fullmatch(d["word"]):
+                n_candidates += 1
+                n_label_agree += labels_test.get(d["start"]) == d["entity"]
+
+    return n_sentence_agree / max(len(preds_ref), 1), n_label_agree / max(n_candidates, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", default="benchmarks/fixtures/sweden_hot.json")
+    parser.add_argument("--windows", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threshold", type=float, default=0.985)
+    parser.add_argument("--snapshot-dir", default=None)
+    args = parser.parse_args()
+
+    sentences = load_sentences(args.fixtures)
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    pipe = load_models(device, snapshot_dir=args.snapshot_dir)["pipe"]
+
+    latency_full, preds_full = run(pipe, sentences, args.runs, args.batch_size)
+    print(f"{len(sentences)} sentences")
+    print(f"full sentence: {latency_full * 1000:8.1f} ms/run")
+
+    for window in args.windows:
+        window_pipe = CandidateWindowPipe(pipe, window=window)
+        latency, preds = run(window_pipe, sentences, args.runs, args.batch_size)
+        sentence_agreement, label_agreement = compare(preds_full, preds, args.threshold)
+        print(
+            f"window {window:>5}: {latency * 1000:8.1f} ms/run ({latency_full / latency:.2f}x), "
+            f"actionable agreement {sentence_agreement:.2%}, "
+            f"candidate label agreement {label_agreement:.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,39 @@
+import argparse
 import logging
 import os
+import time
 import torch
 import praw
 import pandas as pd
 import datetime as dt
 from dotenv import load_dotenv
 from transformers import (
-    AutoModelForSeq2SeqLM,
     AutoModelForTokenClassification,
     AutoTokenizer,
     pipeline,
 )
-from src.comment import choose_post, create_reply_msg
+from src.cache import PredictionCache, SentenceMemo, get_model_revision
+from src.comment import choose_post, create_reply_msg, filter_submissions, filter_threads
+from src.fetch import fetch_threads
+from src.history import HistoryStore
+from src.inference import CandidateWindowPipe
+from src.delta import CrawlState
 from src.data import (
-    analyze_comments,
-    download_submission,
-    get_posted_comments,
+    create_preprocess_pool,
+    filter_comments,
+    filter_dedem_comments,
     merge_comment_submission,
+    predict_comments,
+    preprocess_comments,
     save_feather,
 )
-from src.translate import translation_preprocess
+from src.onnx_backend import load_onnx_pipe
+from src.pipeline import BoundedPipeline
+from src.snapshot import load_snapshot
+from src.storage import save_snapshot
+from src.stream import CandidatePool, SubmissionCache, comment_frame, micro_batches
+from src.timing import StageTimer
+from src.translate import load_translation_model, translation_preprocess
 
 logging.basicConfig(
     filename="sprakpolisen.log",
@@ -28,127 +42,480 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
 )
 logger = logging.getLogger(__name__)
-device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
 
-#### Load models
-tokenizer = AutoTokenizer.from_pretrained("Lauler/deformer", model_max_length=250)
-model = AutoModelForTokenClassification.from_pretrained("Lauler/deformer")
-model.to(device)
 
-# NER pipeline
-pipe = pipeline("ner", model=model, tokenizer=tokenizer, device=0)
+def load_models(
+    device,
+    backend="torch",
+    onnx_dir="models/deformer-onnx",
+    quantize_translation=False,
+    snapshot_dir=None,
+    window=None,
+):
+    """
+    Load DeFormer. The Swedish-English translation model is loaded by load_translation
+    once there is a comment to reply to.
+    backend: "torch" or "onnx" (int8 quantized ONNX Runtime model, see src/onnx_backend.py).
+    quantize_translation: Use a dynamic int8 quantized translation model (CPU only).
+    snapshot_dir: Memory map both models from a local snapshot (see src/snapshot.py).
+    window: Score only this many tokens on each side of every de/dem (CandidateWindowPipe).
+    """
+    if backend == "onnx":
+        pipe = load_onnx_pipe(onnx_dir, quantized=True)
+    else:
+        if snapshot_dir is not None:
+            model, tokenizer = load_snapshot("Lauler/deformer", snapshot_dir)
+            tokenizer.model_max_length = 250
+        else:
+            tokenizer = AutoTokenizer.from_pretrained("Lauler/deformer", model_max_length=250)
+            model = AutoModelForTokenClassification.from_pretrained("Lauler/deformer")
+        model.to(device)
 
-# Machine Translation model
-tokenizer_translate = AutoTokenizer.from_pretrained("Helsinki-NLP/opus-mt-sv-en")
-model_translate = AutoModelForSeq2SeqLM.from_pretrained(
-    "Helsinki-NLP/opus-mt-sv-en", output_attentions=True
-)
-model_translate.eval()
-model_translate.to(device)
-
-#### Load env variables
-load_dotenv()
-username = os.getenv("USR")
-pw = os.getenv("PW")
-client_id = os.getenv("CLIENT_ID")
-client_secret = os.getenv("CLIENT_SECRET")
-
-#### API
-reddit = praw.Reddit(
-    client_id=client_id,
-    client_secret=client_secret,
-    user_agent=username,
-    username=username,
-    password=pw,
-)
+        # NER pipeline
+        pipe = pipeline("ner", model=model, tokenizer=tokenizer, device=device)
 
-subreddit = reddit.subreddit("sweden")
+    if window is not None:
+        pipe = CandidateWindowPipe(pipe, window=window)
 
+    return {
+        "pipe": pipe,
+        "model_translate": None,
+        "tokenizer_translate": None,
+        "quantize_translation": quantize_translation,
+        "snapshot_dir": snapshot_dir,
+    }
 
-df_subs = []
-df_comments = []
 
-for submission in subreddit.hot(limit=35):
-    if submission.num_comments == 0:
-        continue
+def load_translation(models, device):
+    """
+    Load the machine translation model the first time it is needed and keep it in models.
+    """
+    if models["model_translate"] is None:
+        models["model_translate"], models["tokenizer_translate"] = load_translation_model(
+            "Helsinki-NLP/opus-mt-sv-en",
+            device=device,
+            quantize=models["quantize_translation"],
+            snapshot_dir=models["snapshot_dir"],
+        )
 
-    df_sub = download_submission(submission)
-    df_comment = analyze_comments(submission, pipe=pipe)
-    df_subs.append(df_sub)
-    df_comments.append(df_comment)
+    return models["model_translate"], models["tokenizer_translate"]
 
-df_sub = pd.concat(df_subs).reset_index(drop=True)
-df_comment = pd.concat(df_comments).reset_index(drop=True)
 
-#### Write comment and submission info to file ####
-date = dt.datetime.now().strftime("%Y-%m-%d_%H-%M")
-save_feather(df_comment, type="comment", date=date)
-save_feather(df_sub, type="submission", date=date)
+def get_reddit():
+    #### Load env variables
+    load_dotenv()
+    username = os.getenv("USR")
+    pw = os.getenv("PW")
+    client_id = os.getenv("CLIENT_ID")
+    client_secret = os.getenv("CLIENT_SECRET")
 
-# Merge
-df_all = merge_comment_submission(df_comment=df_comment, df_sub=df_sub)
+    #### API
+    reddit = praw.Reddit(
+        client_id=client_id,
+        client_secret=client_secret,
+        user_agent=username,
+        username=username,
+        password=pw,
+    )
 
-try:
-    df_history = get_posted_comments()  # Get SprakpolisenBot's previous replies to comments
-    # Don't post twice in same thread
-    df_all = df_all[~df_all["link_id"].isin(df_history["link_id"])].reset_index(drop=True)
-except:
-    pass
+    return reddit
 
-df_all = df_all[~(df_all["n_mis_det"] == 1)].reset_index(drop=True)
 
-# Choose which comment to post reply to
-df_post = choose_post(df_all, min_hour=0.7, max_hour=19)
+def get_history(path="data/history.db"):
+    """
+    SprakpolisenBot's previous replies. Migrates the old feather files on first use.
+    """
+    history = HistoryStore(path)
+    if len(history) == 0:
+        history.migrate_from_feather()
 
-df_all.columns
-# df_post = df_all.iloc[1:2].reset_index(drop=True)
+    return history
 
-df_post["sentences"] = df_post["sentences"].apply(
-    lambda sens: [sen.replace("…", ".") for sen in sens]
-)
 
-#### Translate to English
-pipes = translation_preprocess(
-    df_post,
-    model_translate=model_translate,
-    tokenizer_translate=tokenizer_translate,
-    device=device,
-)
+def reply_to_best(reddit, df_all, models, device, history, date, timer):
+    """
+    Choose the best candidate in df_all (merged comments and submissions), translate the
+    corrections and reply to it. Returns the comment that was replied to.
+    """
+    # Choose which comment to post reply to
+    with timer.stage("choose"):
+        df_post = choose_post(df_all, min_hour=0.7, max_hour=19)
 
-reply_msg = create_reply_msg(df_post, pipes=pipes)
+    # df_post = df_all.iloc[1:2].reset_index(drop=True)
 
+    df_post["sentences"] = df_post["sentences"].apply(
+        lambda sens: [sen.replace("…", ".") for sen in sens]
+    )
 
-save_feather(df_all, type="all", date=date)
+    #### Translate to English
+    with timer.stage("translate"):
+        model_translate, tokenizer_translate = load_translation(models, device)
+        pipes = translation_preprocess(
+            df_post,
+            model_translate=model_translate,
+            tokenizer_translate=tokenizer_translate,
+            device=device,
+        )
 
-for i in range(len(df_all)):
-    try:
-        # Reply to chosen comment
-        logging.info(f'Replying to comment id {df_post["id"][0]}.')
-        comment = reddit.comment(df_post["id"][0])
-        comment.reply(body=reply_msg)
-        break
-    except Exception as e:
-        if isinstance(e, praw.exceptions.RedditAPIException):
-            # Due to incredibly stupid changes on reddit around how blocked comments work,
-            # SprakpolisenBot may be blocked from replying to anyone in a comment chain
-            # if a single comment author in the comment chain has blocked SprakpolisenBot.
-            logging.error(f'Failed replying to comment id {df_post["id"][0]} because of block.')
-            df_all = df_all[df_all["id"] != df_post["id"][0]]  # Remove unsuccessful reply attempt
-            df_post = choose_post(df_all, min_hour=1, max_hour=19)
-
-            #### Translate to English
-            pipes = translation_preprocess(
-                df_post,
-                model_translate=model_translate,
-                tokenizer_translate=tokenizer_translate,
-                device=device,
+        reply_msg = create_reply_msg(df_post, pipes=pipes)
+
+    with timer.stage("save"):
+        save_snapshot(df_all, type="all", date=date)
+
+    for i in range(len(df_all)):
+        try:
+            # Reply to chosen comment
+            logging.info(f'Replying to comment id {df_post["id"][0]}.')
+            with timer.stage("reply"):
+                comment = reddit.comment(df_post["id"][0])
+                comment.reply(body=reply_msg)
+            break
+        except Exception as e:
+            if isinstance(e, praw.exceptions.RedditAPIException):
+                # Due to incredibly stupid changes on reddit around how blocked comments work,
+                # SprakpolisenBot may be blocked from replying to anyone in a comment chain
+                # if a single comment author in the comment chain has blocked SprakpolisenBot.
+                logging.error(f'Failed replying to comment id {df_post["id"][0]} because of block.')
+                # Remove unsuccessful reply attempt
+                df_all = df_all[df_all["id"] != df_post["id"][0]]
+                df_post = choose_post(df_all, min_hour=1, max_hour=19)
+
+                #### Translate to English
+                pipes = translation_preprocess(
+                    df_post,
+                    model_translate=model_translate,
+                    tokenizer_translate=tokenizer_translate,
+                    device=device,
+                )
+                reply_msg = create_reply_msg(df_post, pipes=pipes)
+
+    logging.info("Succesfully replied.")
+
+    # Save replies/posted comments
+    df_post["replied"] = True
+    df_post["replied_time"] = pd.to_datetime(pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"))
+    save_feather(df_post, type="posted", date=date)
+    history.append(df_post)
+
+    return df_post
+
+
+def run_cycle(
+    reddit,
+    models,
+    device,
+    cache=None,
+    memo=None,
+    history=None,
+    fetch_workers=4,
+    reddit_factory=None,
+    timer=None,
+    delta=True,
+    preprocess_pool=None,
+    queue_size=8,
+    max_batch=8,
+):
+    """
+    Fetch hot submissions, analyze their comments, choose a comment with
+    incorrect de/dem and reply to it. Returns a StageTimer with per stage timings.
+    delta: Only analyze new or edited comments, and carry forward the candidates of
+    unchanged threads and comments from previous runs (see src/delta.py).
+    reddit_factory: Creates a Reddit instance per fetch worker, e.g. get_reddit (see
+    fetch_threads).
+    preprocess_pool: Process pool for sentence splitting (see create_preprocess_pool).
+    queue_size, max_batch: Capacity of the queue between fetching and inference, and the
+    max number of comment trees predicted on together (see src/pipeline.py).
+    """
+    if timer is None:
+        timer = StageTimer()
+    if history is None:
+        history = get_history()
+    if cache is not None:
+        cache.start_run()
+
+    pipe = models["pipe"]
+
+    subreddit = reddit.subreddit("sweden")
+
+    def is_eligible(df_sub):
+        # Don't post twice in same thread
+        if history.has_replied_in_thread(df_sub["name_sub"][0]):
+            return False
+
+        # Skip threads that choose_post would filter away before downloading their comments
+        if len(filter_submissions(df_sub, min_hour=0.7, max_hour=19)) == 0:
+            return False
+
+        # Skip threads without new comments since the previous run
+        if crawl is not None and crawl.is_unchanged(df_sub):
+            logger.info(f"Thread {df_sub['permalink_sub'][0]} unchanged since previous run.")
+            unchanged_threads.append(df_sub["id_sub"][0])
+            return False
+
+        return True
+
+    with timer.stage("fetch"):
+        submissions = [
+            submission for submission in subreddit.hot(limit=35) if submission.num_comments > 0
+        ]
+        crawl = CrawlState([submission.id for submission in submissions]) if delta else None
+
+    df_subs = []
+    df_seen = []
+    df_candidates = []
+    unchanged_threads = []
+    unchanged_comments = []
+    n_analyzed = 0
+
+    # Comment trees are downloaded concurrently by a producer thread, while the comments
+    # that have arrived are preprocessed and predicted on in batches
+    pipeline = BoundedPipeline(maxsize=queue_size, max_batch=max_batch)
+    threads = fetch_threads(
+        submissions,
+        reddit,
+        is_eligible=is_eligible,
+        max_workers=fetch_workers,
+        reddit_factory=reddit_factory,
+    )
+    for batch in timer.timed("fetch", pipeline.batches(threads)):
+        df_comments = []
+        for df_sub, df_comment in batch:
+            df_subs.append(df_sub)
+
+            if df_comment is None:
+                continue
+
+            df_seen.append(df_comment[["id", "id_sub", "edited"]])
+            if crawl is not None:
+                df_comment, unchanged_ids = crawl.split_comments(df_comment)
+                unchanged_comments += unchanged_ids
+
+            if len(df_comment) > 0:
+                timer.count("comments", len(df_comment))
+                n_analyzed += len(df_comment)
+                df_comments.append(df_comment)
+
+        if len(df_comments) == 0:
+            continue
+
+        # Preprocess and predict the comments of all submissions in the batch together
+        with timer.stage("preprocess"):
+            # Cheap regex prefilter on the raw body before sentence splitting
+            df_comment = filter_dedem_comments(pd.concat(df_comments).reset_index(drop=True))
+            timer.count("prefiltered", len(df_comment))
+            df_comment = preprocess_comments(df_comment, executor=preprocess_pool)
+
+        if len(df_comment) == 0:
+            continue  # No comment in the batch had a de/dem sentence
+        timer.count("sentences", int(df_comment["sentences"].apply(len).sum()))
+        with timer.stage("predict"):
+            df_comment, df_ent = predict_comments(
+                df_comment, pipe, threshold=0.985, batch_size=32, cache=cache, memo=memo
             )
-            reply_msg = create_reply_msg(df_post, pipes=pipes)
+        with timer.stage("filter"):
+            df_candidates.append(filter_comments(df_comment, df_ent))
+
+    pipeline.log_summary()
+    if cache is not None:
+        cache.log_stats()
+
+    try:
+        assert n_analyzed > 0 or len(unchanged_threads + unchanged_comments) > 0
+    except AssertionError as e:
+        logger.exception("No threads eligible for reply. Exiting.")
+        raise e
+
+    df_sub = pd.concat(df_subs).reset_index(drop=True)
+
+    if crawl is not None:
+        df_candidates.append(crawl.previous_candidates(unchanged_threads, unchanged_comments))
+    df_comment = pd.concat(df_candidates).reset_index(drop=True)
+
+    #### Write comment and submission info to file ####
+    date = dt.datetime.now().strftime("%Y-%m-%d_%H-%M")
+    with timer.stage("save"):
+        save_snapshot(df_comment, type="comment", date=date)
+        save_snapshot(df_sub, type="submission", date=date)
+        if len(df_seen) > 0:
+            save_snapshot(pd.concat(df_seen), type="seen", date=date)
+
+    # Merge
+    df_all = merge_comment_submission(df_comment=df_comment, df_sub=df_sub)
+
+    # Don't post twice in same thread
+    df_all = df_all[~df_all["link_id"].apply(history.has_replied_in_thread)].reset_index(drop=True)
+
+    df_all = df_all[~(df_all["n_mis_det"] == 1)].reset_index(drop=True)
+
+    reply_to_best(reddit, df_all, models, device, history, date, timer)
+
+    timer.log_summary()
+    return timer
+
+
+def run_stream(
+    reddit,
+    models,
+    device,
+    cache=None,
+    memo=None,
+    history=None,
+    batch_size=32,
+    max_wait=10.0,
+    reply_interval=30 * 60,
+    stop=None,
+    preprocess_pool=None,
+):
+    """
+    Analyze new comments from the comment stream of r/sweden as they arrive, in micro
+    batches of at most batch_size comments or max_wait seconds, and keep the reply
+    candidates in a rolling pool (see src/stream.py). The best candidate is replied to
+    as soon as reply_interval seconds have passed since the previous reply.
+    stop: threading.Event, checked between batches. Returns a StageTimer.
+    """
+    if history is None:
+        history = get_history()
+    if cache is not None:
+        cache.start_run()
+
+    pipe = models["pipe"]
+    timer = StageTimer()
+    pool = CandidatePool(max_hours=19)
+    submissions = SubmissionCache(reddit)
+    last_reply = None
+
+    subreddit = reddit.subreddit("sweden")
+    stream = subreddit.stream.comments(skip_existing=True, pause_after=0)
+    for batch in timer.timed("fetch", micro_batches(stream, batch_size, max_wait)):
+        if stop is not None and stop.is_set():
+            break
+
+        if len(batch) > 0:
+            df_comment = comment_frame(batch)
+            # Don't post twice in same thread
+            replied = df_comment["link_id"].apply(history.has_replied_in_thread).astype(bool)
+            df_comment = df_comment[~replied].reset_index(drop=True)
+            timer.count("comments", len(df_comment))
+            with timer.stage("preprocess"):
+                df_comment = filter_dedem_comments(df_comment)
+                timer.count("prefiltered", len(df_comment))
+                df_comment = preprocess_comments(df_comment, executor=preprocess_pool)
+        else:
+            df_comment = None
+
+        if df_comment is not None and len(df_comment) > 0:
+            timer.count("sentences", int(df_comment["sentences"].apply(len).sum()))
+            with timer.stage("predict"):
+                df_comment, df_ent = predict_comments(
+                    df_comment, pipe, threshold=0.985, batch_size=32, cache=cache, memo=memo
+                )
+            with timer.stage("filter"):
+                pool.add(filter_comments(df_comment, df_ent))
+
+        pool.prune()
+        if len(pool) == 0:
+            continue
+        if last_reply is not None and time.monotonic() - last_reply < reply_interval:
+            continue
+
+        with timer.stage("fetch"):
+            df_sub = submissions.get(pool.id_subs())
+        df_all = merge_comment_submission(df_comment=pool.df, df_sub=df_sub)
+        df_all = df_all[~(df_all["n_mis_det"] == 1)].reset_index(drop=True)
+
+        # Candidates in threads that are too young may become eligible later
+        if len(filter_threads(df_all, min_hour=0.7, max_hour=19)) == 0:
+            continue
+
+        date = dt.datetime.now().strftime("%Y-%m-%d_%H-%M")
+        df_post = reply_to_best(reddit, df_all, models, device, history, date, timer)
+        pool.remove_thread(df_post["link_id"][0])
+        last_reply = time.monotonic()
+        timer.log_summary()
+        if cache is not None:
+            cache.log_stats()
+
+    timer.log_summary()
+    return timer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run SprakpolisenBot once.")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--onnx-dir", default="models/deformer-onnx")
+    parser.add_argument("--quantize-translation", action="store_true")
+    parser.add_argument(
+        "--snapshot-dir", default=None, help="Load models from a local snapshot (src/snapshot.py)."
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=None,
+        help="Tokens of context scored on each side of de/dem (default: whole sentences).",
+    )
+    parser.add_argument(
+        "--sentence-cache",
+        action="store_true",
+        help="Keep sentence predictions in data/sentences.db between runs.",
+    )
+    parser.add_argument(
+        "--full-crawl",
+        action="store_true",
+        help="Analyze all comments, also those unchanged since the previous run.",
+    )
+    parser.add_argument(
+        "--preprocess-workers",
+        type=int,
+        default=1,
+        help="Processes for sentence splitting and text cleaning (1: main process only).",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=8,
+        help="Downloaded comment trees that may wait for inference before fetching pauses.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    models = load_models(
+        device,
+        backend=args.backend,
+        onnx_dir=args.onnx_dir,
+        quantize_translation=args.quantize_translation,
+        snapshot_dir=args.snapshot_dir,
+        window=args.window,
+    )
+    # Raw predictions of previously scored comments
+    model_revision = get_model_revision(models["pipe"])
+    cache = PredictionCache(path="data/cache.db", model_revision=model_revision)
+    # Predictions of repeated sentences, optionally kept between runs
+    memo = SentenceMemo(
+        path="data/sentences.db" if args.sentence_cache else None, model_revision=model_revision
+    )
+    history = get_history()
+    reddit = get_reddit()
+    preprocess_pool = create_preprocess_pool(args.preprocess_workers)
+
+    run_cycle(
+        reddit,
+        models,
+        device=device,
+        cache=cache,
+        memo=memo,
+        history=history,
+        reddit_factory=get_reddit,
+        delta=not args.full_crawl,
+        preprocess_pool=preprocess_pool,
+        queue_size=args.queue_size,
+    )
 
+    if preprocess_pool is not None:
+        preprocess_pool.shutdown()
 
-logging.info("Succesfully replied.")
 
-# Save replies/posted comments
-df_post["replied"] = True
-df_post["replied_time"] = pd.to_datetime(pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"))
-save_feather(df_post, type="posted", date=date)
+if __name__ == "__main__":
+    main()
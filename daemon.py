@@ -0,0 +1,171 @@
+import argparse
+import logging
+import signal
+import threading
+import time
+import torch
+from bot import get_history, get_reddit, load_models, run_cycle, run_stream
+from src.data import create_preprocess_pool
+from src.cache import PredictionCache, SentenceMemo, get_model_revision
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run SprakpolisenBot as a long running process with models kept in memory."
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=30,
+        help="Minutes between the start of two consecutive cycles.",
+    )
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--onnx-dir", default="models/deformer-onnx")
+    parser.add_argument("--quantize-translation", action="store_true")
+    parser.add_argument(
+        "--snapshot-dir", default=None, help="Load models from a local snapshot (src/snapshot.py)."
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=None,
+        help="Tokens of context scored on each side of de/dem (default: whole sentences).",
+    )
+    parser.add_argument(
+        "--sentence-cache",
+        action="store_true",
+        help="Keep sentence predictions in data/sentences.db between runs.",
+    )
+    parser.add_argument(
+        "--full-crawl",
+        action="store_true",
+        help="Analyze all comments, also those unchanged since the previous run.",
+    )
+    parser.add_argument(
+        "--preprocess-workers",
+        type=int,
+        default=1,
+        help="Processes for sentence splitting and text cleaning (1: main process only).",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=8,
+        help="Downloaded comment trees that may wait for inference before fetching pauses.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Analyze new comments from the comment stream as they arrive, instead of polling "
+        "the hot threads every interval. Replies at most once per interval.",
+    )
+    parser.add_argument(
+        "--stream-batch-size",
+        type=int,
+        default=32,
+        help="Max streamed comments analyzed together.",
+    )
+    parser.add_argument(
+        "--stream-max-wait",
+        type=float,
+        default=10,
+        help="Max seconds a streamed comment waits for its batch to fill up.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    interval = args.interval * 60
+
+    # Finish the current cycle and exit on SIGINT/SIGTERM
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}. Shutting down after current cycle.")
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    logger.info("Loading models.")
+    models = load_models(
+        device,
+        backend=args.backend,
+        onnx_dir=args.onnx_dir,
+        quantize_translation=args.quantize_translation,
+        snapshot_dir=args.snapshot_dir,
+        window=args.window,
+    )
+    model_revision = get_model_revision(models["pipe"])
+    cache = PredictionCache(path="data/cache.db", model_revision=model_revision)
+    # Kept in memory between cycles, and optionally on disk between restarts
+    memo = SentenceMemo(
+        path="data/sentences.db" if args.sentence_cache else None, model_revision=model_revision
+    )
+    history = get_history()
+    reddit = get_reddit()
+    preprocess_pool = create_preprocess_pool(args.preprocess_workers)
+
+    while args.stream and not stop.is_set():
+        logger.info("Starting comment stream.")
+        try:
+            run_stream(
+                reddit,
+                models,
+                device=device,
+                cache=cache,
+                memo=memo,
+                history=history,
+                batch_size=args.stream_batch_size,
+                max_wait=args.stream_max_wait,
+                reply_interval=interval,
+                stop=stop,
+                preprocess_pool=preprocess_pool,
+            )
+            break  # Stopped
+        except Exception:
+            # E.g. reddit being unavailable, restart the stream after a while
+            logger.exception("Comment stream failed.")
+            stop.wait(60)
+
+    cycle = 0
+    while not args.stream and not stop.is_set():
+        cycle += 1
+        start = time.time()
+        logger.info(f"Starting cycle {cycle}.")
+
+        try:
+            run_cycle(
+                reddit,
+                models,
+                device=device,
+                cache=cache,
+                memo=memo,
+                history=history,
+                reddit_factory=get_reddit,
+                delta=not args.full_crawl,
+                preprocess_pool=preprocess_pool,
+                queue_size=args.queue_size,
+            )
+        except Exception:
+            # A failed cycle (no candidates, reddit errors, ...) should not kill the daemon
+            logger.exception(f"Cycle {cycle} failed.")
+
+        elapsed = time.time() - start
+        logger.info(f"Finished cycle {cycle} in {elapsed:.1f} seconds.")
+        stop.wait(max(0, interval - elapsed))
+
+    cache.close()
+    memo.close()
+    if preprocess_pool is not None:
+        preprocess_pool.shutdown()
+    history.close()
+    logger.info("Daemon stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import os
+import json
+import hashlib
+import sqlite3
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def hash_body(body):
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def hash_sentences(sentences):
+    return hash_body(json.dumps(list(sentences), ensure_ascii=False))
+
+
+def get_model_revision(pipe):
+    """
+    Model name and (if loaded from the hub) commit hash of the model behind a pipe.
+    """
+    config = pipe.model.config
+    revision = getattr(config, "_commit_hash", None)
+    window = getattr(pipe, "window", None)  # CandidateWindowPipe predictions differ slightly
+
+    if window is not None:
+        return f"{config._name_or_path}@{revision}+window{window}"
+    return f"{config._name_or_path}@{revision}"
+
+
+class PredictionCache:
+    """
+    On-disk cache of raw DeFormer predictions per comment.
+
+    Entries are keyed by comment id and model revision, and are only used when the
+    hash of the comment's preprocessed sentences and the "edited" timestamp are
+    unchanged. The predictions' offsets refer to those sentences, so a change to the
+    preprocessing (rules, sentence splitter) invalidates the entry. Edited comments
+    overwrite their old entry. (The body_hash column holds the sentences hash.)
+    """
+
+    def __init__(self, path="data/cache.db", model_revision=""):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS predictions (
+                id TEXT,
+                model TEXT,
+                body_hash TEXT,
+                edited INTEGER,
+                pred TEXT,
+                PRIMARY KEY (id, model)
+            )
+            """
+        )
+        self.model_revision = model_revision
+        self.hits = 0
+        self.misses = 0
+        self.run_start = (0, 0)  # hits and misses at the start of the current run
+
+    def get(self, id, sentences, edited):
+        row = self.conn.execute(
+            "SELECT body_hash, edited, pred FROM predictions WHERE id = ? AND model = ?",
+            (id, self.model_revision),
+        ).fetchone()
+
+        if row is None or row[0] != hash_sentences(sentences) or row[1] != int(edited):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(row[2])
+
+    def put_many(self, ids, sentences, editeds, preds):
+        rows = [
+            (
+                id,
+                self.model_revision,
+                hash_sentences(sens),
+                int(edited),
+                json.dumps(pred, default=lambda x: x.item()),  # numpy scalars to python
+            )
+            for id, sens, edited, pred in zip(ids, sentences, editeds, preds)
+        ]
+        self.conn.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+
+    def start_run(self):
+        """
+        Count hits and misses from here on as a new run (e.g. a daemon cycle).
+        """
+        self.run_start = (self.hits, self.misses)
+
+    def run_stats(self):
+        return self.hits - self.run_start[0], self.misses - self.run_start[1]
+
+    def hit_rate(self):
+        hits, misses = self.run_stats()
+        return hits / (hits + misses) if hits + misses > 0 else 0.0
+
+    def log_stats(self):
+        hits, misses = self.run_stats()
+        logger.info(
+            f"Prediction cache: {hits} hits, {misses} misses this run "
+            f"(hit rate {self.hit_rate():.1%}), {self.hits} hits, {self.misses} misses since start."
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+class SentenceMemo:
+    """
+    Predictions per normalized sentence, so that sentences repeated across comments
+    (quotes, copypasta, common phrases) are scored once.
+
+    An in-process LRU of at most maxsize sentences, optionally backed by an SQLite
+    table at path that persists between runs. Keyed by model revision and sentence hash.
+    """
+
+    def __init__(self, maxsize=50000, path=None, model_revision=""):
+        self.lru = OrderedDict()
+        self.maxsize = maxsize
+        self.model_revision = model_revision
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(path)
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sentences (
+                    model TEXT,
+                    sentence_hash TEXT,
+                    pred TEXT,
+                    PRIMARY KEY (model, sentence_hash)
+                )
+                """
+            )
+
+    def get(self, sentence):
+        key = hash_body(sentence)
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            self.hits += 1
+            return self.lru[key]
+
+        if self.conn is not None:
+            row = self.conn.execute(
+                "SELECT pred FROM sentences WHERE model = ? AND sentence_hash = ?",
+                (self.model_revision, key),
+            ).fetchone()
+            if row is not None:
+                self.hits += 1
+                self.add(key, json.loads(row[0]))
+                return self.lru[key]
+
+        self.misses += 1
+        return None
+
+    def add(self, key, pred):
+        self.lru[key] = pred
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.maxsize:
+            self.lru.popitem(last=False)
+
+    def put_many(self, sentences, preds):
+        keys = [hash_body(sentence) for sentence in sentences]
+        for key, pred in zip(keys, preds):
+            self.add(key, pred)
+
+        if self.conn is not None:
+            rows = [
+                (self.model_revision, key, json.dumps(pred, default=lambda x: x.item()))
+                for key, pred in zip(keys, preds)
+            ]
+            self.conn.executemany("INSERT OR REPLACE INTO sentences VALUES (?, ?, ?)", rows)
+            self.conn.commit()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def log_stats(self):
+        logger.info(
+            f"Sentence memo: {len(self.lru)} sentences in memory, {self.hits} hits, "
+            f"{self.misses} misses (hit rate {self.hit_rate():.1%})."
+        )
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
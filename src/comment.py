@@ -1,4 +1,5 @@
 import logging
+import datetime as dt
 
 from .markdown import (
     add_horizontal_rule,
@@ -17,6 +18,33 @@ from .markdown import (
 logger = logging.getLogger(__name__)
 
 
+def filter_threads(df, min_hour, max_hour):
+    """
+    Keep only rows belonging to threads we are allowed to reply in.
+    Works on both submission and merged comment/submission dataframes.
+    """
+    # Filter away any threads with "seriös" tag or "seriös" in submission title.
+    # Filter away comments in threads younger than 1h and older than 15h.
+    df = df[~(df["link_flair_text_sub"].str.lower() == "seriös")]
+    df = df[~(df["title_sub"].str.lower().str.contains("seriös"))]
+    df = df[(df["hours_age_thread"] > min_hour) & (df["hours_age_thread"] < max_hour)]
+    df = df[~df["locked_sub"]]  # Thread should not be locked
+
+    return df
+
+
+def filter_submissions(df_sub, min_hour, max_hour):
+    """
+    Apply the thread filters of choose_post to downloaded submissions, so that comments
+    from threads that could never be replied to are not downloaded and predicted.
+    """
+    df_sub = df_sub.copy()
+    df_sub["hours_age_thread"] = (dt.datetime.now().timestamp() - df_sub["created_sub"]) / 3600
+    df_sub = filter_threads(df_sub, min_hour=min_hour, max_hour=max_hour)
+
+    return df_sub.drop(columns=["hours_age_thread"]).reset_index(drop=True)
+
+
 def choose_post(df_all, min_hour, max_hour):
     """
     Choose which comment to post reply.
@@ -25,14 +53,7 @@ def choose_post(df_all, min_hour, max_hour):
     logger.info(
         "Choosing comment to reply to: Filtering out 'seriös' threads and too young/old threads."
     )
-    # Filter away any threads with "seriös" tag or "seriös" in submission title.
-    # Filter away comments in threads younger than 1h and older than 15h.
-    df_all = df_all[~(df_all["link_flair_text_sub"].str.lower() == "seriös")]
-    df_all = df_all[~(df_all["title_sub"].str.lower().str.contains("seriös"))]
-    df_all = df_all[
-        (df_all["hours_age_thread"] > min_hour) & (df_all["hours_age_thread"] < max_hour)
-    ]
-    df_all = df_all[~df_all["locked_sub"]]  # Thread should not be locked
+    df_all = filter_threads(df_all, min_hour=min_hour, max_hour=max_hour)
     df_all = df_all.sort_values("hours_age_thread").reset_index(drop=True)
 
     try:
@@ -2,14 +2,26 @@ import glob
 import os
 import datetime as dt
 import re
+import math
 import pandas as pd
 import logging
+import signal
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from nltk.tokenize import sent_tokenize
 from .markdown import remove_emoji
-
+from .entities import count_entities, empty_entities, entities_from_preds, preds_from_entities
+from .inference import DEDEM_PATTERN, predict_batched
+from .rules import DE_SOM_RULE, DOM_RULE, RuleEngine
+from .storage import load_latest
 
 logger = logging.getLogger(__name__)
 
+# Suppression rules, applied to sentences before inference and to predictions after
+rule_engine = RuleEngine()
+de_som_engine = RuleEngine([DE_SOM_RULE])
+dom_engine = RuleEngine([DOM_RULE])
+
 KEEP_COMMENT_COLUMNS = [
     "id",
     "link_id",
@@ -81,11 +93,18 @@ KEEP_SUBMISSION_COLUMNS = [
 
 def filter_dedem_comments(df):
     """
-    Keep only comments with de/dem.
+    Keep only comments with de/dem. Cheap enough to run on the raw body of every
+    downloaded comment before sentence splitting.
     """
-    dedem_pattern = "(?<!\w)[Dd][Ee][Mm]?(?![\w\*])"
-    df = df[df["body"].str.contains(dedem_pattern)].reset_index(drop=True)
-    return df
+    has_dedem = [DEDEM_PATTERN.search(body) is not None for body in df["body"]]
+    df_dedem = df.loc[has_dedem].reset_index(drop=True)
+
+    if len(df) > 0:
+        logger.info(
+            f"Prefilter rejected {len(df) - len(df_dedem)} of {len(df)} comments "
+            f"({1 - len(df_dedem) / len(df):.1%})."
+        )
+    return df_dedem
 
 
 def filter_dedem_sentences(sentences):
@@ -93,15 +112,10 @@ def filter_dedem_sentences(sentences):
     Keep only sentences with de/dem.
     """
 
-    dedem_pattern = "(?<!\w)[Dd][Ee][Mm]?(?![\w\*])"
-    dedem_sentences = filter(lambda sentence: bool(re.search(dedem_pattern, sentence)), sentences)
+    dedem_sentences = filter(lambda sentence: DEDEM_PATTERN.search(sentence), sentences)
 
-    # Don't match the string 'de och dem', as this indicatse people discussing the grammar of de vs dem.
-    dedem_sentences = filter(lambda sentence: "De och dem" not in sentence, dedem_sentences)
-    dedem_sentences = filter(lambda sentence: "de och dem" not in sentence, dedem_sentences)
-
-    # Don't match single word sentences
-    dedem_sentences = filter(lambda sentence: len(sentence.split()) > 1, dedem_sentences)
+    # Don't match 'de och dem' (grammar discussions) or single word sentences. See src/rules.py.
+    dedem_sentences = filter(rule_engine.keep_sentence, dedem_sentences)
 
     return list(dedem_sentences)
 
@@ -112,41 +126,8 @@ def predict_dedem(comment, pipe):
     Keep only "de" or "dem" predictions where model has predicted
     differently from the text that was present in the comment.
     """
-
-    de_pattern = "(?<!\w)[D][Ee](?!\w)"
-    dem_pattern = "(?<!\w)[D][Ee][Mm](?!\w)"
-    det_pattern = "(?<!\w)[D][Ee][Tt](?!\w)"
-    enda_pattern = "(?<!\w)[Ee][Nn][Dd][Aa](?!\w)"
-    anda_pattern = "(?<!\w)[Ää][Nn][Dd][Aa](?!\w)"
-    comment = [re.sub(de_pattern, "de", sentence) for sentence in comment]
-    comment = [re.sub(dem_pattern, "dem", sentence) for sentence in comment]
-    comment = [re.sub(det_pattern, "det", sentence) for sentence in comment]
-    comment = [re.sub(enda_pattern, "enda", sentence) for sentence in comment]
-    comment = [re.sub(anda_pattern, "ända", sentence) for sentence in comment]
-    preds = [pipe(sentence) for sentence in comment]
-
-    pred_list = []
-    for pred in preds:
-        # Keep only predictions where model has predicted differently from the text that was present in the comment.
-        pred_list.append(
-            [d for d in pred if (d["entity"] != "ord") and (d["entity"].lower() != d["word"])]
-        )
-
-    return pred_list
-
-
-def filter_prediction(preds, threshold=0.9):
-    """
-    Keep only predictions above confidence threshold.
-    """
-    keep_preds = []
-    for sentence_preds in preds:
-        if len(sentence_preds) > 0:
-            keep_preds.append([pred for pred in sentence_preds if pred["score"] > threshold])
-        else:
-            keep_preds.append([])
-
-    return keep_preds
+    # Same path as the batched prediction of many comments, so that both give the same result
+    return predict_batched([comment], pipe)[0]
 
 
 def date_to_epoch(year, month, day, hour=0, minute=0, second=0):
@@ -154,32 +135,11 @@ def date_to_epoch(year, month, day, hour=0, minute=0, second=0):
 
 
 def filter_de_som(sentences, preds):
-    for i, data in enumerate(zip(sentences, preds)):
-        sentence = data[0]
-        sentence = sentence.lower()
-        pred = data[1]
-
-        for j, entity in reversed(list(enumerate(pred))):
-            # expand to include " som" after "de/dem"
-            expanded_entity = sentence[entity["start"] : (entity["end"] + 4)]
-
-            if expanded_entity == "de som" or expanded_entity == "dem som":
-                pred.pop(j)  # We don't want model to predict on "de/dem som"
-                preds[i] = pred
-
-    return preds
+    return de_som_engine.filter_preds(sentences, preds)
 
 
 def filter_dom(sentences, preds):
-    for i, data in enumerate(zip(sentences, preds)):
-        pred = data[1]
-
-        for j, entity in reversed(list(enumerate(pred))):
-            if entity["word"].lower() == "dom":
-                pred.pop(j)
-                preds[i] = pred
-
-    return preds
+    return dom_engine.filter_preds(sentences, preds)
 
 
 def download_submission(submission):
@@ -211,129 +171,170 @@ def download_comments(submission):
     return df
 
 
-def preprocess_comments(df):
-    logger.info(f"Preprocessing {len(df)} comments...")
+QUOTE_PATTERN = re.compile(">.*\n\n")
+SPACES_PATTERN = re.compile(" {2,}")
+
 
+def clean_sentences(body):
+    """
+    Generator of the cleaned candidate sentences (with de/dem) of a comment body,
+    in a single pass over the sentences.
+    """
     # Remove sentences that are quotes from other comments.
     # Comments that start with ">" and end with "\n\n" are quotes.
-    df["body_temp"] = df["body"].str.replace(">.*\n\n", "", regex=True)
-    df["body_temp"] = df["body_temp"].str.replace("\n\n\n", "\n\n", regex=True)
+    body = QUOTE_PATTERN.sub("", body).replace("\n\n\n", "\n\n")
 
-    # Split comment body into list of sentences
-    df["sentences"] = df["body_temp"].apply(lambda doc: sent_tokenize(doc, language="swedish"))
-    df = df.drop(columns=["body_temp"])
+    # Split comment body into sentences and keep only sentences with de/dem
+    for sentence in filter_dedem_sentences(sent_tokenize(body, language="swedish")):
+        # Split sentences also on new paragraphs "\n\n" (in case someone doesn't use punctuation)
+        for line in sentence.splitlines():
+            if len(line) == 0:
+                continue
 
-    # Keep only sentences with de/dem
-    df["sentences"] = df["sentences"].apply(lambda sen: filter_dedem_sentences(sen))
-    df = df[df["sentences"].apply(lambda x: any([len(y) != 0 for y in x])) > 0].reset_index(
-        drop=True
-    )
+            # Remove emojis, strip whitespace and replace 2 or more spaces by a single space
+            yield SPACES_PATTERN.sub(" ", remove_emoji(line).strip())
 
-    # Split sentences also on new paragraphs "\n\n" (in case someone doesn't use punctuation)
-    df["sentences"] = df["sentences"].apply(lambda sens: [sen.splitlines() for sen in sens])
-    # Flatten list of lists and remove empty sentences consisting of only ''.
-    df["sentences"] = df["sentences"].apply(
-        lambda sens: [sen for split_sens in sens for sen in split_sens]
-    )
-    df["sentences"] = [[sen for sen in sens if len(sen) > 0] for sens in df["sentences"]]
 
-    # Remove emojis
-    df["sentences"] = df["sentences"].apply(lambda sens: [remove_emoji(sen) for sen in sens])
+def preprocess_stream(comments):
+    """
+    Preprocess a stream of comments (dicts or objects with a body) without building a
+    dataframe. Yields (comment, sentences) for comments with de/dem sentences.
+    """
+    for comment in comments:
+        body = comment["body"] if isinstance(comment, dict) else comment.body
+        if body is None or DEDEM_PATTERN.search(body) is None:
+            continue
 
-    # Strip whitespace before and after sentence.
-    df["sentences"] = df["sentences"].apply(lambda sens: [sen.strip() for sen in sens])
+        sentences = list(clean_sentences(body))
+        if len(sentences) > 0:
+            yield comment, sentences
 
-    # Remove 2 or more spaces in a row and replace by single space.
-    df["sentences"] = df["sentences"].apply(
-        lambda sens: [re.sub(" {2,}", " ", sen) for sen in sens]
-    )
 
-    logger.info("Finished preprocessing.")
+def clean_body(body):
+    """
+    All clean_sentences of a body as a list (picklable, for process pool workers).
+    """
+    return list(clean_sentences(body))
 
-    return df
 
+def ignore_interrupt():
+    # Ctrl-C is handled by the parent process, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-def predict_comments(df, pipe, threshold=0.98):
-    logger.info(f"Predicting with threshold {threshold}...")
 
-    # Predict
-    df["pred"] = df["sentences"].apply(lambda x: predict_dedem(x, pipe))
+def create_preprocess_pool(workers):
+    """
+    Process pool for preprocess_comments, or None for workers <= 1 (preprocess in the
+    main process). Workers are spawned rather than forked, so they don't inherit the
+    models or locks held by the fetch threads.
+    """
+    if workers is None or workers <= 1:
+        return None
+
+    logger.info(f"Starting preprocessing pool with {workers} workers.")
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=ignore_interrupt,
+    )
 
-    # Keep only high confidence predictions
-    df["pred"] = df["pred"].apply(lambda preds: filter_prediction(preds, threshold=threshold))
 
-    # Remove "de/dem som" and "dom"
-    if len(df) > 0:
-        df["pred"] = df.apply(lambda x: filter_de_som(x.sentences, x.pred), axis=1)
-        df["pred"] = df.apply(lambda x: filter_dom(x.sentences, x.pred), axis=1)
+def preprocess_comments(df, executor=None, chunksize=None):
+    """
+    executor: Optional process pool (see create_preprocess_pool). The comment bodies are
+    then sharded across the workers in chunks of chunksize comments (default: one chunk
+    per worker).
+    """
+    logger.info(f"Preprocessing {len(df)} comments...")
+
+    if executor is not None and len(df) > 0:
+        if chunksize is None:
+            chunksize = math.ceil(len(df) / executor._max_workers)
+        sentences = list(executor.map(clean_body, df["body"], chunksize=chunksize))
+    else:
+        sentences = [clean_body(body) for body in df["body"]]
+    has_sentences = [len(sens) > 0 for sens in sentences]
+
+    df = df.assign(sentences=sentences)
+    df = df.loc[has_sentences].reset_index(drop=True)
+
+    logger.info("Finished preprocessing.")
 
     return df
 
 
-def count_incorrect_word(preds, word):
+def predict_cached(df, pipe, cache, batch_size=32, memo=None):
     """
-    Only use for "det".
+    Look up raw predictions of unchanged comments in the cache, and predict
+    only the new or edited comments.
     """
-    count = 0
-    for pred in preds:
-        for entity in pred:
-            if len(pred) == 0:
-                break
+    preds = [
+        cache.get(id, sentences, edited)
+        for id, sentences, edited in zip(df["id"], df["sentences"], df["edited"])
+    ]
+    miss_idx = [i for i, pred in enumerate(preds) if pred is None]
 
-            count += 1 if (entity["word"].lower() == word and entity["entity"] != "DET") else 0
+    miss_preds = predict_batched(
+        [df["sentences"].iloc[i] for i in miss_idx], pipe, batch_size=batch_size, memo=memo
+    )
+    cache.put_many(
+        ids=[df["id"].iloc[i] for i in miss_idx],
+        sentences=[df["sentences"].iloc[i] for i in miss_idx],
+        editeds=[df["edited"].iloc[i] for i in miss_idx],
+        preds=miss_preds,
+    )
 
-    return count
+    for i, pred in zip(miss_idx, miss_preds):
+        preds[i] = pred
 
+    logger.info(f"Prediction cache: {len(df) - len(miss_idx)} of {len(df)} comments cached.")
+    return preds
 
-def count_all_word(preds, word):
+
+def predict_comments(df, pipe, threshold=0.98, batch_size=32, cache=None, memo=None):
     """
-    Count all occurrences of a word in the original comment (entity["word"] is the original word).
+    Returns the comments and a flat entity table (see src/entities.py) of their
+    high confidence de/dem predictions.
     """
-    count = 0
-    for pred in preds:
-        for entity in pred:
-            if len(pred) == 0:
-                break
-
-            count += 1 if entity["word"].lower() == word else 0
+    logger.info(f"Predicting with threshold {threshold}...")
+    df = df.reset_index(drop=True)
+    if len(df) == 0:
+        return df, empty_entities()
 
-    return count
+    # Predict all sentences of all comments in length bucketed batches
+    if cache is not None:
+        preds = predict_cached(df, pipe, cache, batch_size=batch_size, memo=memo)
+    else:
+        preds = predict_batched(df["sentences"].tolist(), pipe, batch_size=batch_size, memo=memo)
 
+    df_ent = entities_from_preds(preds)
 
-def count_incorrect_entity(preds, word):
-    count = 0
-    for pred in preds:
-        for entity in pred:
-            if len(pred) == 0:
-                break
+    # Keep only high confidence predictions
+    df_ent = df_ent[df_ent["score"] > threshold]
 
-            count += 1 if entity["entity"].lower() == word else 0
+    # Remove "de/dem som", "dom" and the other suppression rules in src/rules.py
+    df_ent = rule_engine.filter_entities(df_ent, df["sentences"])
+    rule_engine.log_stats()
 
-    return count
+    return df, df_ent.reset_index(drop=True)
 
 
-def filter_comments(df):
+def filter_comments(df, df_ent):
+    """
+    Keep comments with at least one prediction left in the entity table, count their
+    mistakes and attach their predictions as a nested "pred" column.
+    """
     logger.info("Filtering comments...")
+    df = df.reset_index(drop=True)
+
     # Remove rows with only empty predictions (i.e. sentence preds under the threshold)
-    df_comment = df[df["pred"].apply(lambda x: any([len(y) != 0 for y in x])) > 0].reset_index(
-        drop=True
-    )
+    df_counts = count_entities(df_ent, n_comments=len(df))
+    keep = (df_counts["n_mis"] > 0).to_numpy()
+    df_comment = df[keep].copy()
+    df_comment["pred"] = preds_from_entities(df_ent, df_comment["sentences"].apply(len))
 
     # Create extra variables
-    df_comment["n_mis"] = df_comment["pred"].apply(lambda x: sum([len(y) for y in x]))
-    df_comment["n_mis_de"] = df_comment["pred"].apply(lambda x: count_incorrect_word(x, word="de"))
-    df_comment["n_mis_dem"] = df_comment["pred"].apply(
-        lambda x: count_incorrect_word(x, word="dem")
-    )
-    df_comment["n_mis_det"] = df_comment["pred"].apply(
-        lambda x: count_incorrect_entity(x, word="det")
-    )
-    df_comment["n_mis_enda"] = df_comment["pred"].apply(
-        lambda x: count_incorrect_word(x, word="enda")
-    )
-    df_comment["n_mis_ända"] = df_comment["pred"].apply(
-        lambda x: count_incorrect_word(x, word="ända")
-    )
+    df_comment = df_comment.join(df_counts[keep])
 
     df_comment["author"] = df_comment["author"].apply(lambda x: x.name if x is not None else None)
     df_comment = df_comment[df_comment["author"] != "SprakpolisenBot"]  # Filter out bot's comments
@@ -395,7 +396,14 @@ def merge_comment_submission(df_comment, df_sub):
     return df_all
 
 
-def get_previous_submissions(folder="data/submission"):
+def get_previous_submissions(folder="data/submission", root="data/dataset"):
+    """
+    Latest stored version of every submission. Falls back to the latest feather
+    snapshot if no snapshot dataset exists yet.
+    """
+    if os.path.exists(os.path.join(root, "submission")):
+        return load_latest("submission", root=root)
+
     list_of_files = glob.glob(f"{folder}/*")
 
     # If empty folder, return empty dataframe
@@ -407,29 +415,6 @@ def get_previous_submissions(folder="data/submission"):
     return df_sub
 
 
-def get_posted_comments(folder="data/posted"):
-    """
-    Retrieve and save posted comments to single file.
-    """
-    posted_files = os.listdir(folder)
-
-    if len(posted_files) == 0:
-        df_posted = pd.read_feather("data/posted_aggregated/df_posted.feather")
-        df_posted.to_feather("data/df_posted.feather")
-        return df_posted
-    else:
-        df_gen = (pd.read_feather(os.path.join(folder, file)) for file in posted_files)
-        df = pd.concat(df_gen).reset_index(drop=True)
-
-        if os.path.exists("data/posted_aggregated/df_posted.feather"):
-            df_posted = pd.read_feather("data/posted_aggregated/df_posted.feather")
-            df = pd.concat([df, df_posted]).reset_index(drop=True)
-
-        df.to_feather("data/df_posted.feather")
-
-    return df
-
-
 def aggregate_posted_comments(folder="data/posted"):
     """
     Aggregate posted comments to single file.
@@ -460,21 +445,3 @@ def aggregate_posted_comments(folder="data/posted"):
     df.to_feather(os.path.join(dest_dir, "df_posted.feather"))
 
     return df
-
-
-def analyze_comments(submission, pipe):
-    """
-    Run all filters and predictions on the comments of a submission.
-    """
-
-    df_comment = download_comments(submission)
-    # Regex and sentence splitting
-    df_comment = preprocess_comments(df_comment)
-    # Keep only comments with de/dem
-    df_comment = filter_dedem_comments(df_comment)
-    # Only saves preds above threshold
-    df_comment = predict_comments(df_comment, pipe, threshold=0.985)
-    # Keep only comments with incorrect usage of de/dem/det
-    df_comment = filter_comments(df_comment)
-
-    return df_comment
@@ -0,0 +1,90 @@
+import logging
+from .storage import isin, load_latest
+
+"""
+Delta crawling: compare the current hot threads with what previous runs stored in the
+snapshot dataset (src/storage.py), so that only new or edited comments are analyzed.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlState:
+    """
+    Number of comments per thread at the previous run, and the comments (with their
+    "edited" timestamp) downloaded in previous runs, for the threads in id_subs.
+    Read once per run, for all threads.
+    """
+
+    def __init__(self, id_subs, root="data/dataset"):
+        self.root = root
+        id_subs = list(id_subs)
+
+        df_sub = load_latest("submission", root=root, columns=["num_comments_sub"], ids=id_subs)
+        if len(df_sub) > 0:
+            self.num_comments = dict(zip(df_sub["id_sub"], df_sub["num_comments_sub"]))
+        else:
+            self.num_comments = {}
+
+        # Latest "edited" timestamp of the comments downloaded before, and their threads
+        df_seen = load_latest(
+            "seen",
+            root=root,
+            columns=["id_sub", "edited"],
+            filter=isin("id_sub", id_subs),
+        )
+        if len(df_seen) > 0:
+            self.seen_edited = dict(zip(df_seen["id"], df_seen["edited"]))
+            self.crawled = set(df_seen["id_sub"])
+        else:
+            self.seen_edited = {}
+            self.crawled = set()
+
+    def is_unchanged(self, df_sub):
+        """
+        Thread was crawled before and has the same number of comments as then.
+        """
+        id_sub = df_sub["id_sub"][0]
+        return (
+            id_sub in self.crawled
+            and self.num_comments.get(id_sub) == df_sub["num_comments_sub"][0]
+        )
+
+    def split_comments(self, df_comment):
+        """
+        Split downloaded comments into new or edited comments, and the ids of comments
+        that are unchanged since they were last downloaded.
+        """
+        previous_edited = df_comment["id"].map(self.seen_edited)
+        is_unchanged = previous_edited == df_comment["edited"].astype("int64")
+
+        unchanged_ids = df_comment.loc[is_unchanged, "id"].tolist()
+        return df_comment[~is_unchanged].reset_index(drop=True), unchanged_ids
+
+    def previous_candidates(self, id_subs=(), ids=()):
+        """
+        Stored candidate comments (output of filter_comments) of unchanged threads
+        (id_subs) and unchanged comments (ids).
+        """
+        df = load_latest(
+            "comment", root=self.root, filter=isin("id_sub", id_subs) | isin("id", ids)
+        )
+        if len(df) == 0:
+            return df
+
+        df = df.drop(columns=["_snapshot", "snapshot_date"], errors="ignore")
+
+        # A comment that was edited after it was stored here, and is no longer a candidate,
+        # has no newer candidate row. Keep only rows of the latest seen version.
+        seen_edited = df["id"].map(self.seen_edited)
+        is_stale = seen_edited.notna() & (seen_edited != df["edited"].astype("int64"))
+        if is_stale.any():
+            logger.info(f"Dropping {is_stale.sum()} stale candidates of edited comments.")
+        df = df[~is_stale]
+
+        # Nested columns are read back as arrays
+        df["sentences"] = df["sentences"].apply(list)
+        df["pred"] = df["pred"].apply(lambda preds: [list(pred) for pred in preds])
+
+        logger.info(f"Carrying forward {len(df)} candidate comments from previous runs.")
+        return df.reset_index(drop=True)
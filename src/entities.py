@@ -0,0 +1,117 @@
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+"""
+Flat (struct of arrays) table of DeFormer predictions. One row per predicted entity,
+pointing back to its comment (row position in the comment dataframe) and sentence
+(position in the comment's "sentences" list).
+"""
+
+logger = logging.getLogger(__name__)
+
+ENTITY_SCHEMA = pa.schema(
+    [
+        ("comment_idx", pa.int32()),
+        ("sentence_idx", pa.int32()),
+        ("start", pa.int32()),
+        ("end", pa.int32()),
+        ("word", pa.string()),
+        ("entity", pa.string()),
+        ("score", pa.float32()),
+    ]
+)
+
+ENTITY_FIELDS = ["entity", "score", "word", "start", "end"]
+
+
+def empty_entities():
+    return ENTITY_SCHEMA.empty_table().to_pandas()
+
+
+def entities_from_preds(preds):
+    """
+    Input: Per comment lists of per sentence lists of entity dicts (pipe output).
+    """
+    columns = {name: [] for name in ENTITY_SCHEMA.names}
+    for comment_idx, comment_preds in enumerate(preds):
+        for sentence_idx, sentence_preds in enumerate(comment_preds):
+            for d in sentence_preds:
+                columns["comment_idx"].append(comment_idx)
+                columns["sentence_idx"].append(sentence_idx)
+                columns["start"].append(d["start"])
+                columns["end"].append(d["end"])
+                columns["word"].append(d["word"])
+                columns["entity"].append(d["entity"])
+                columns["score"].append(d["score"])
+
+    return pa.Table.from_pydict(columns, schema=ENTITY_SCHEMA).to_pandas()
+
+
+def preds_from_entities(df_ent, n_sentences):
+    """
+    Inverse of entities_from_preds, for the comments in n_sentences (a Series of
+    sentence counts indexed by comment_idx). Used to attach the nested "pred" column
+    to the few comments that are kept.
+    """
+    preds = {comment_idx: [[] for _ in range(n)] for comment_idx, n in n_sentences.items()}
+    df_ent = df_ent[df_ent["comment_idx"].isin(n_sentences.index)]
+
+    records = df_ent[["comment_idx", "sentence_idx"] + ENTITY_FIELDS].to_dict("records")
+    for record in records:
+        comment_idx = record.pop("comment_idx")
+        sentence_idx = record.pop("sentence_idx")
+        preds[comment_idx][sentence_idx].append(record)
+
+    return [preds[comment_idx] for comment_idx in n_sentences.index]
+
+
+def sentence_text(df_ent, sentences):
+    """
+    The sentence each entity was predicted in. sentences: the "sentences" column.
+    """
+    if len(df_ent) == 0:
+        return np.array([], dtype=object)
+
+    # Integer dtype also when sentences is empty (apply(len) then gives floats)
+    n_sentences = np.array([len(sens) for sens in sentences], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(n_sentences)]).astype(np.int64)
+    flat_sentences = np.array([sen for sens in sentences for sen in sens], dtype=object)
+    return flat_sentences[
+        offsets[df_ent["comment_idx"].to_numpy()] + df_ent["sentence_idx"].to_numpy()
+    ]
+
+
+def count_entities(df_ent, n_comments):
+    """
+    Number of mistakes per comment: n_mis in total, n_mis_{word} for the original words
+    de/dem/enda/ända (excluding predictions of DET), and n_mis_det for predictions of DET.
+    """
+    word = df_ent["word"].str.lower()
+    not_det = df_ent["entity"] != "DET"
+    masks = {
+        "n_mis": pd.Series(True, index=df_ent.index),
+        "n_mis_de": (word == "de") & not_det,
+        "n_mis_dem": (word == "dem") & not_det,
+        "n_mis_det": df_ent["entity"].str.lower() == "det",
+        "n_mis_enda": (word == "enda") & not_det,
+        "n_mis_ända": (word == "ända") & not_det,
+    }
+
+    df_counts = pd.DataFrame(masks).astype("int64")
+    df_counts = df_counts.groupby(df_ent["comment_idx"].to_numpy()).sum()
+    return df_counts.reindex(range(n_comments), fill_value=0)
+
+
+def to_arrow(df_ent):
+    return pa.Table.from_pandas(df_ent, schema=ENTITY_SCHEMA, preserve_index=False)
+
+
+def save_entities(df_ent, path):
+    feather.write_feather(to_arrow(df_ent), path)
+
+
+def load_entities(path):
+    return feather.read_table(path).to_pandas()
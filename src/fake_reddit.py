@@ -0,0 +1,160 @@
+import json
+import time
+import logging
+from .data import KEEP_COMMENT_COLUMNS, KEEP_SUBMISSION_COLUMNS
+
+"""
+Local stand-in for the parts of the PRAW API that the bot uses, backed by recorded
+fixtures. Used to run and benchmark the full pipeline without reddit credentials.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class FakeRedditor:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeSubredditRef:
+    def __init__(self, display_name):
+        self.display_name = display_name
+
+
+class FakeCommentForest:
+    def __init__(self, comments):
+        self._comments = comments
+
+    def list(self):
+        return list(self._comments)
+
+
+class FakeComment:
+    def __init__(self, data, reddit):
+        self._reddit = reddit
+        for key, value in data.items():
+            setattr(self, key, value)
+        self.author = FakeRedditor(data["author"]) if data.get("author") else None
+        self.subreddit = FakeSubredditRef(data.get("subreddit", "sweden"))
+
+    def reply(self, body):
+        logger.info(f"Fake reply to comment id {self.id}.")
+        self._reddit.replies.append({"id": self.id, "body": body})
+
+
+class FakeSubmission:
+    def __init__(self, data, reddit):
+        comments = data.pop("comments", [])
+        for key, value in data.items():
+            setattr(self, key, value)
+        self.author = FakeRedditor(data["author"]) if data.get("author") else None
+        self.comments = FakeCommentForest([FakeComment(c, reddit) for c in comments])
+
+
+class FakeSubredditStream:
+    def __init__(self, submissions):
+        self._submissions = submissions
+
+    def comments(self, skip_existing=False, pause_after=None):
+        """
+        All comments of the fixtures, oldest first. Unlike the live stream it ends after
+        one pass (with a None first if pause_after is set, as when no new comments arrive).
+        """
+        comments = [c for submission in self._submissions for c in submission.comments.list()]
+        yield from sorted(comments, key=lambda comment: comment.created_utc)
+        if pause_after is not None:
+            yield None
+
+
+class FakeSubreddit:
+    def __init__(self, display_name, submissions):
+        self.display_name = display_name
+        self._submissions = submissions
+        self.stream = FakeSubredditStream(submissions)
+
+    def hot(self, limit=100):
+        return iter(self._submissions[:limit])
+
+
+class FakeAuth:
+    def __init__(self):
+        self.limits = {"remaining": None, "reset_timestamp": None, "used": None}
+
+
+class FakeReddit:
+    """
+    fixtures: dict as written by record_fixtures. Timestamps are shifted so that the
+    threads have the same age relative to now as they had when they were recorded.
+    """
+
+    def __init__(self, fixtures, shift_time=True):
+        offset = time.time() - fixtures["recorded_at"] if shift_time else 0
+        self.auth = FakeAuth()
+        self.replies = []
+
+        submissions = []
+        for sub_data in fixtures["submissions"]:
+            sub_data = shift_timestamps(dict(sub_data), offset)
+            sub_data["comments"] = [
+                shift_timestamps(dict(c), offset) for c in sub_data.get("comments", [])
+            ]
+            submissions.append(FakeSubmission(sub_data, self))
+
+        self._subreddit = FakeSubreddit(fixtures["subreddit"], submissions)
+        self._submissions = {submission.id: submission for submission in submissions}
+        self._comments = {
+            comment.id: comment
+            for submission in submissions
+            for comment in submission.comments.list()
+        }
+
+    def subreddit(self, display_name):
+        return self._subreddit
+
+    def submission(self, id):
+        return self._submissions[id]
+
+    def comment(self, id):
+        return self._comments[id]
+
+
+def shift_timestamps(data, offset):
+    for key in ["created", "created_utc"]:
+        if data.get(key) is not None:
+            data[key] = data[key] + offset
+    return data
+
+
+def load_fixtures(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def record_fixtures(reddit, path, subreddit="sweden", limit=35):
+    """
+    Record the hot submissions of a subreddit and their comments from the live API.
+    """
+    submissions = []
+    for submission in reddit.subreddit(subreddit).hot(limit=limit):
+        logger.info(f"Recording {submission.permalink}.")
+        submission.num_duplicates  # Force the API to fetch this attribute
+        sub_data = {key: vars(submission).get(key) for key in KEEP_SUBMISSION_COLUMNS}
+        sub_data["author"] = submission.author.name if submission.author else None
+
+        comments = []
+        for comment in submission.comments.list():
+            if not hasattr(comment, "body"):
+                continue  # MoreComments
+            comment_data = {key: vars(comment).get(key) for key in KEEP_COMMENT_COLUMNS}
+            comment_data["author"] = comment.author.name if comment.author else None
+            comment_data["subreddit"] = comment.subreddit.display_name
+            comments.append(comment_data)
+
+        sub_data["comments"] = comments
+        submissions.append(sub_data)
+
+    fixtures = {"subreddit": subreddit, "recorded_at": time.time(), "submissions": submissions}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(fixtures, f, ensure_ascii=False, default=str)
+
+    return fixtures
@@ -0,0 +1,108 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .data import download_comments, download_submission
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket shared by all fetch workers. One token is used per API request.
+    The refill rate follows reddit's rate limit headers (remaining requests until reset).
+    """
+
+    def __init__(self, rate=1.0, capacity=4):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def update_from_limits(self, limits):
+        """
+        limits: reddit.auth.limits, e.g. {"remaining": 580.0, "reset_timestamp": 1690000000.0, "used": 20}
+        """
+        remaining = limits.get("remaining")
+        reset_timestamp = limits.get("reset_timestamp")
+        if remaining is None or reset_timestamp is None:
+            return
+
+        with self.lock:
+            self._refill()
+            seconds_to_reset = max(reset_timestamp - time.time(), 1)
+            # Spread the remaining requests evenly until the rate limit window resets
+            self.rate = max(remaining, 1) / seconds_to_reset
+            self.tokens = min(self.tokens, remaining)
+
+
+def fetch_thread(submission, reddit, bucket, is_eligible=None):
+    """
+    Download a submission and, if it is eligible for reply, its comment tree.
+    Returns (df_sub, df_comment), where df_comment is None for skipped threads.
+    """
+    # Fetching the submission also fetches its comment tree, in a single request
+    bucket.acquire()
+    df_sub = download_submission(submission)
+    bucket.update_from_limits(reddit.auth.limits)
+
+    if is_eligible is not None and not is_eligible(df_sub):
+        logger.info(f"Skipping comments of {submission.permalink}, thread not eligible for reply.")
+        return df_sub, None
+
+    df_comment = download_comments(submission)
+
+    return df_sub, df_comment
+
+
+def fetch_threads(
+    submissions, reddit, is_eligible=None, max_workers=4, bucket=None, reddit_factory=None
+):
+    """
+    Download submissions and their comment trees concurrently.
+    Yields (df_sub, df_comment) tuples in the order the downloads complete.
+    reddit_factory: Creates the Reddit instance of each worker thread, since PRAW is not
+    thread safe. Without it all workers share reddit (only safe for FakeReddit).
+    """
+    if bucket is None:
+        bucket = TokenBucket(rate=1.0, capacity=max_workers)
+        # Start at the rate allowed by the rate limit headers of earlier requests, if any
+        bucket.update_from_limits(reddit.auth.limits)
+
+    local = threading.local()
+
+    def fetch(submission):
+        if reddit_factory is None:
+            return fetch_thread(submission, reddit, bucket, is_eligible)
+
+        if not hasattr(local, "reddit"):
+            local.reddit = reddit_factory()
+        submission = local.reddit.submission(submission.id)
+        return fetch_thread(submission, local.reddit, bucket, is_eligible)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [executor.submit(fetch, submission) for submission in submissions]
+
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # If the consumer stops early (closes this generator), drop the queued downloads
+        executor.shutdown(wait=False, cancel_futures=True)
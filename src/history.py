@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import logging
+import argparse
+import threading
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COLUMNS = ["id", "link_id", "id_sub", "author", "permalink", "body", "replied_time"]
+
+
+class HistoryStore:
+    """
+    Append-only store of SprakpolisenBot's replies, indexed on thread (link_id) and
+    comment id, so "have we replied in this thread" is a single index lookup.
+    Safe to use from the fetch worker threads.
+    """
+
+    def __init__(self, path="data/history.db"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS posted (
+                    id TEXT PRIMARY KEY,
+                    link_id TEXT,
+                    id_sub TEXT,
+                    author TEXT,
+                    permalink TEXT,
+                    body TEXT,
+                    replied_time TEXT
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_posted_link_id ON posted (link_id)")
+            self.conn.commit()
+
+    def append(self, df_post):
+        """
+        Add replied to comments. Comments already in the store are ignored.
+        """
+        df = df_post.reindex(columns=HISTORY_COLUMNS)
+        df["replied_time"] = df["replied_time"].astype(str)
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO posted VALUES (?, ?, ?, ?, ?, ?, ?)", list(rows)
+            )
+            self.conn.commit()
+
+    def has_replied_in_thread(self, link_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM posted WHERE link_id = ? LIMIT 1", (link_id,)
+            ).fetchone()
+        return row is not None
+
+    def has_replied_to(self, id):
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM posted WHERE id = ? LIMIT 1", (id,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM posted").fetchone()[0]
+
+    def to_dataframe(self):
+        with self.lock:
+            return pd.read_sql_query("SELECT * FROM posted", self.conn)
+
+    def migrate_from_feather(
+        self, folder="data/posted", aggregated="data/posted_aggregated/df_posted.feather"
+    ):
+        """
+        Import replies from the per run feather files in data/posted and the file
+        written by aggregate_posted_comments.
+        """
+        files = []
+        if os.path.exists(folder):
+            files += [os.path.join(folder, file) for file in os.listdir(folder)]
+        if os.path.exists(aggregated):
+            files.append(aggregated)
+
+        if len(files) == 0:
+            return 0
+
+        df = pd.concat([pd.read_feather(file) for file in files]).reset_index(drop=True)
+        n_before = len(self)
+        self.append(df)
+        n_added = len(self) - n_before
+        logger.info(f"Migrated {n_added} replies from {len(files)} feather files to history.")
+
+        return n_added
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate posted replies to the history store.")
+    parser.add_argument("--path", default="data/history.db")
+    parser.add_argument("--folder", default="data/posted")
+    parser.add_argument("--aggregated", default="data/posted_aggregated/df_posted.feather")
+    args = parser.parse_args()
+
+    history = HistoryStore(args.path)
+    n_added = history.migrate_from_feather(args.folder, args.aggregated)
+    print(f"Added {n_added} replies. History contains {len(history)} replies.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import re
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+DE_PATTERN = re.compile(r"(?<!\w)[D][Ee](?!\w)")
+DEM_PATTERN = re.compile(r"(?<!\w)[D][Ee][Mm](?!\w)")
+DET_PATTERN = re.compile(r"(?<!\w)[D][Ee][Tt](?!\w)")
+ENDA_PATTERN = re.compile(r"(?<!\w)[Ee][Nn][Dd][Aa](?!\w)")
+ANDA_PATTERN = re.compile(r"(?<!\w)[Ää][Nn][Dd][Aa](?!\w)")
+
+# de/dem in any capitalization, not followed by * (censored words). Used to find candidate
+# comments and sentences.
+DEDEM_PATTERN = re.compile(r"(?<!\w)[Dd][Ee][Mm]?(?![\w\*])")
+
+# Words DeFormer can give actionable predictions for
+CANDIDATE_PATTERN = re.compile(r"(?<!\w)(?:de|dem|det|dom|enda|ända)(?!\w)", re.IGNORECASE)
+
+
+def normalize_sentence(sentence):
+    """
+    Lower case capitalized de/dem/det/enda/ända so the model sees the same form
+    regardless of how the word was capitalized in the comment.
+    """
+    sentence = DE_PATTERN.sub("de", sentence)
+    sentence = DEM_PATTERN.sub("dem", sentence)
+    sentence = DET_PATTERN.sub("det", sentence)
+    sentence = ENDA_PATTERN.sub("enda", sentence)
+    sentence = ANDA_PATTERN.sub("ända", sentence)
+    return sentence
+
+
+def keep_mismatches(pred):
+    """
+    Keep only predictions where model has predicted differently from the text
+    that was present in the comment.
+    """
+    return [d for d in pred if (d["entity"] != "ord") and (d["entity"].lower() != d["word"])]
+
+
+def length_buckets(lengths, batch_size, max_batch_tokens=None):
+    """
+    Group sequence indices into batches of similar length. Padding is done per batch,
+    so sorting by length keeps the padded sequences short.
+    max_batch_tokens: Also cap the padded size (batch size * longest sequence) of a batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+    batches = []
+    batch = []
+    for i in order:
+        # Sorted by length, so the new sequence is the longest in the batch
+        too_many_tokens = max_batch_tokens is not None and (
+            (len(batch) + 1) * lengths[i] > max_batch_tokens
+        )
+        if len(batch) > 0 and (len(batch) == batch_size or too_many_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+
+    if len(batch) > 0:
+        batches.append(batch)
+
+    return batches
+
+
+def word_start_tokens(offsets):
+    """
+    Indices of the tokens that start a new word (not ##subword or attached punctuation).
+    """
+    return [i for i in range(len(offsets)) if i == 0 or offsets[i][0] > offsets[i - 1][1]] + [
+        len(offsets)
+    ]
+
+
+def sentence_chunks(offsets, max_tokens, stride):
+    """
+    Split a tokenized sentence that is longer than max_tokens into chunks of at most
+    max_tokens tokens, where consecutive chunks overlap by about stride tokens. Chunks
+    start and end at word boundaries.
+
+    Returns (start, end, own_start, own_end) character spans per chunk. Predictions in
+    the overlap are taken from the chunk that owns them: the one where they are further
+    from the chunk's edge (i.e. have more context).
+    """
+    word_starts = word_start_tokens(offsets)
+    n_tokens = len(offsets)
+
+    token_spans = []
+    first = 0
+    while True:
+        # Last word boundary that keeps the chunk within max_tokens
+        end = max([i for i in word_starts if i <= first + max_tokens], default=first)
+        if end <= first:
+            end = min(first + max_tokens, n_tokens)  # A single word longer than max_tokens
+        token_spans.append((first, end))
+
+        if end >= n_tokens:
+            break
+        next_first = min([i for i in word_starts if i >= end - stride], default=end)
+        first = next_first if next_first > first else end
+
+    chunks = []
+    for k, (first, end) in enumerate(token_spans):
+        own_start = 0 if k == 0 else chunks[-1][3]
+        if k == len(token_spans) - 1:
+            own_end = offsets[-1][1]
+        else:
+            # Split the overlap with the next chunk in the middle
+            next_first = token_spans[k + 1][0]
+            own_end = offsets[min((next_first + end) // 2, n_tokens - 1)][0]
+        chunks.append((offsets[first][0], offsets[end - 1][1], own_start, own_end))
+
+    return chunks
+
+
+def predict_sentences(sentences, pipe, batch_size=32, max_batch_tokens=8192, stride=32):
+    """
+    Run the token classification pipe over a flat list of (normalized) sentences.
+
+    Sentences longer than the tokenizer's model_max_length are split into overlapping
+    chunks (see sentence_chunks) and their predictions merged by character offset.
+    Sentences and chunks are sorted into length buckets and passed to the pipe in
+    batches of at most batch_size sequences and max_batch_tokens padded tokens, and the
+    predictions are returned in the same order as the input sentences.
+    """
+    if len(sentences) == 0:
+        return []
+
+    tokenizer = pipe.tokenizer
+    max_tokens = tokenizer.model_max_length - tokenizer.num_special_tokens_to_add()
+    encodings = tokenizer(sentences, add_special_tokens=False, return_offsets_mapping=True)
+
+    # (sentence index, offset, owned character span of chunks, text, number of tokens)
+    pieces = []
+    for i, sentence in enumerate(sentences):
+        offsets = encodings["offset_mapping"][i]
+        if len(offsets) <= max_tokens:
+            pieces.append((i, 0, None, None, sentence, len(offsets)))
+            continue
+
+        chunks = sentence_chunks(offsets, max_tokens=max_tokens, stride=stride)
+        logger.info(f"Split sentence of {len(offsets)} tokens into {len(chunks)} chunks.")
+        for start, end, own_start, own_end in chunks:
+            pieces.append((i, start, own_start, own_end, sentence[start:end], max_tokens))
+
+    preds = [[] for _ in sentences]
+    lengths = [n_tokens + tokenizer.num_special_tokens_to_add() for *_, n_tokens in pieces]
+
+    for batch_idx in length_buckets(lengths, batch_size, max_batch_tokens=max_batch_tokens):
+        batch = [pieces[j][4] for j in batch_idx]
+        batch_preds = pipe(batch, batch_size=len(batch))
+
+        for j, pred in zip(batch_idx, batch_preds):
+            i, offset, own_start, own_end, _, _ = pieces[j]
+            if own_start is None:
+                preds[i] = pred  # Whole sentence
+                continue
+
+            for d in pred:
+                d = {**d, "start": d["start"] + offset, "end": d["end"] + offset}
+                if own_start <= d["start"] < own_end:
+                    preds[i].append(d)
+
+    # Chunks of a sentence can end up in different batches
+    for i in {piece[0] for piece in pieces if piece[2] is not None}:
+        preds[i] = sorted(preds[i], key=lambda d: d["start"])
+
+    return preds
+
+
+def predict_batched(comments, pipe, batch_size=32, memo=None):
+    """
+    Input: List of sentence splitted comments (list of lists of sentences).
+    Predict all sentences of all comments in batches and scatter the predictions
+    back to a list of per sentence predictions for every comment.
+    Identical (normalized) sentences are only predicted once, and with a memo
+    (SentenceMemo) not at all if they were predicted before.
+    """
+    sentences = [normalize_sentence(sentence) for comment in comments for sentence in comment]
+    unique_sentences = list(dict.fromkeys(sentences))
+
+    unique_preds = {}
+    if memo is not None:
+        for sentence in unique_sentences:
+            pred = memo.get(sentence)
+            if pred is not None:
+                unique_preds[sentence] = pred
+
+    miss_sentences = [sentence for sentence in unique_sentences if sentence not in unique_preds]
+    logger.info(
+        f"Predicting {len(miss_sentences)} sentences ({len(unique_sentences)} unique, "
+        f"{len(sentences)} total) from {len(comments)} comments with batch size {batch_size}."
+    )
+    miss_preds = predict_sentences(miss_sentences, pipe, batch_size=batch_size)
+    miss_preds = [keep_mismatches(pred) for pred in miss_preds]
+    unique_preds.update(zip(miss_sentences, miss_preds))
+
+    if memo is not None:
+        memo.put_many(miss_sentences, miss_preds)
+        memo.log_stats()
+
+    # Copies, since the predictions of repeated sentences are otherwise shared
+    preds = [[dict(d) for d in unique_preds[sentence]] for sentence in sentences]
+
+    pred_list = []
+    offset = 0
+    for comment in comments:
+        pred_list.append(preds[offset : (offset + len(comment))])
+        offset += len(comment)
+
+    return pred_list
+
+
+def merge_windows(windows):
+    """
+    Merge overlapping or adjacent (first, last) token index windows.
+    """
+    merged = []
+    for first, last in sorted(windows):
+        if len(merged) > 0 and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+class CandidateWindowPipe:
+    """
+    Wraps a token classification pipe so that only a window of `window` tokens on each
+    side of every de/dem/det/dom/enda/ända occurrence is scored, instead of the whole
+    sentence. Overlapping windows are merged, and windows are widened to whole words.
+    Gives the same output format as the pipe, with start/end relative to the original
+    sentence (index is relative to the window). Sentences without candidates get no
+    predictions at all.
+    """
+
+    def __init__(self, pipe, window=16):
+        self.pipe = pipe
+        self.model = pipe.model
+        self.tokenizer = pipe.tokenizer
+        self.window = window
+
+    def spans(self, sentence):
+        """
+        Character spans (start, end) of the merged candidate windows of a sentence.
+        """
+        candidates = [match.start() for match in CANDIDATE_PATTERN.finditer(sentence)]
+        if len(candidates) == 0:
+            return []
+
+        offsets = self.tokenizer(sentence, add_special_tokens=False, return_offsets_mapping=True)[
+            "offset_mapping"
+        ]
+        token_ends = [end for _, end in offsets]
+
+        windows = []
+        for char_idx in candidates:
+            token_idx = bisect.bisect_right(token_ends, char_idx)
+            windows.append(
+                (max(token_idx - self.window, 0), min(token_idx + self.window, len(offsets) - 1))
+            )
+
+        spans = []
+        for first, last in merge_windows(windows):
+            if first == 0 and last == len(offsets) - 1:
+                return [(0, len(sentence))]  # Window covers the whole sentence
+
+            # Don't cut words in the middle (subword tokens)
+            start = sentence.rfind(" ", 0, offsets[first][0]) + 1
+            end = sentence.find(" ", offsets[last][1])
+            end = len(sentence) if end == -1 else end
+
+            if len(spans) > 0 and start <= spans[-1][1]:
+                spans[-1] = (spans[-1][0], end)  # Widened windows overlap
+            else:
+                spans.append((start, end))
+
+        return spans
+
+    def __call__(self, inputs, batch_size=1, **kwargs):
+        sentences = [inputs] if isinstance(inputs, str) else inputs
+
+        pieces = []
+        for i, sentence in enumerate(sentences):
+            for start, end in self.spans(sentence):
+                pieces.append((i, start, sentence[start:end]))
+
+        preds = [[] for _ in sentences]
+        if len(pieces) > 0:
+            piece_preds = self.pipe(
+                [piece for _, _, piece in pieces], batch_size=batch_size, **kwargs
+            )
+            for (i, offset, _), pred in zip(pieces, piece_preds):
+                for d in pred:
+                    preds[i].append({**d, "start": d["start"] + offset, "end": d["end"] + offset})
+
+        return preds[0] if isinstance(inputs, str) else preds
@@ -0,0 +1,159 @@
+import os
+import time
+import logging
+import argparse
+from transformers import AutoTokenizer, pipeline
+from .inference import keep_mismatches, normalize_sentence
+
+"""
+Optional ONNX Runtime backend for DeFormer with dynamic int8 quantization.
+Requires optimum[onnxruntime].
+"""
+
+logger = logging.getLogger(__name__)
+
+# Fixed sentences for comparing predictions of the ONNX model against the PyTorch model.
+PARITY_SENTENCES = [
+    "Jag såg dem i affären igår.",
+    "Jag såg de i affären igår.",
+    "De som vill stanna kan göra det.",
+    "Dem som vill stanna kan göra det.",
+    "Dem flesta håller nog med om det.",
+    "De flesta håller nog med om det.",
+    "Jag gav dem boken och de blev glada.",
+    "Jag gav de boken och dem blev glada.",
+    "Det är de enda som förstår.",
+    "Vi gick ända fram till dem.",
+    "Har du frågat dem om de kommer?",
+    "Har du frågat de om dem kommer?",
+    "De har aldrig brytt sig om underhållet.",
+    "Dem har aldrig brytt sig om underhållet.",
+    "Hyresvärdarna vet att de kan höja hyran när dem vill.",
+    "Jag tycker inte om dem där nya reglerna.",
+    "De där nya reglerna är dåliga.",
+    "Kan du ge mig dem där pennorna?",
+    "Dem är ju helt galna.",
+    "Jag litar inte på de politikerna.",
+]
+
+
+def export_deformer(model_name="Lauler/deformer", out_dir="models/deformer-onnx", quantize=True):
+    """
+    Export DeFormer to ONNX and (optionally) apply dynamic int8 quantization.
+    The quantized model is saved as model_quantized.onnx next to model.onnx.
+    """
+    from optimum.onnxruntime import ORTModelForTokenClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    logger.info(f"Exporting {model_name} to ONNX in {out_dir}.")
+    model = ORTModelForTokenClassification.from_pretrained(model_name, export=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, model_max_length=250)
+    model.save_pretrained(out_dir)
+    tokenizer.save_pretrained(out_dir)
+
+    if quantize:
+        logger.info("Applying dynamic int8 quantization.")
+        quantizer = ORTQuantizer.from_pretrained(model)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=out_dir, quantization_config=qconfig)
+
+    return out_dir
+
+
+def load_onnx_pipe(onnx_dir="models/deformer-onnx", quantized=True):
+    """
+    NER pipe backed by ONNX Runtime. Gives the same output (entity, score, index,
+    word, start, end) as the PyTorch pipe.
+    """
+    from optimum.onnxruntime import ORTModelForTokenClassification
+
+    file_name = "model_quantized.onnx" if quantized else "model.onnx"
+    if not os.path.exists(os.path.join(onnx_dir, file_name)):
+        raise FileNotFoundError(
+            f"{file_name} not found in {onnx_dir}. Export it first with "
+            "`python -m src.onnx_backend export`."
+        )
+
+    model = ORTModelForTokenClassification.from_pretrained(onnx_dir, file_name=file_name)
+    tokenizer = AutoTokenizer.from_pretrained(onnx_dir, model_max_length=250)
+
+    return pipeline("ner", model=model, tokenizer=tokenizer)
+
+
+def parity_check(pipe_ref, pipe_test, sentences=PARITY_SENTENCES, threshold=0.985):
+    """
+    Compare token labels, scores and actionable (above threshold) predictions of
+    two pipes on a fixed sentence set.
+    """
+    sentences = [normalize_sentence(sentence) for sentence in sentences]
+
+    start = time.perf_counter()
+    preds_ref = [pipe_ref(sentence) for sentence in sentences]
+    time_ref = time.perf_counter() - start
+
+    start = time.perf_counter()
+    preds_test = [pipe_test(sentence) for sentence in sentences]
+    time_test = time.perf_counter() - start
+
+    n_tokens = 0
+    n_label_agree = 0
+    max_score_diff = 0.0
+    n_sentence_agree = 0
+
+    for pred_ref, pred_test in zip(preds_ref, preds_test):
+        tokens_test = {(d["start"], d["end"]): d for d in pred_test}
+        for d in pred_ref:
+            n_tokens += 1
+            d_test = tokens_test.get((d["start"], d["end"]))
+            if d_test is None:
+                continue
+            n_label_agree += d["entity"] == d_test["entity"]
+            max_score_diff = max(max_score_diff, abs(float(d["score"]) - float(d_test["score"])))
+
+        actionable_ref = [
+            (d["start"], d["entity"]) for d in keep_mismatches(pred_ref) if d["score"] > threshold
+        ]
+        actionable_test = [
+            (d["start"], d["entity"]) for d in keep_mismatches(pred_test) if d["score"] > threshold
+        ]
+        n_sentence_agree += actionable_ref == actionable_test
+
+    return {
+        "n_sentences": len(sentences),
+        "label_agreement": n_label_agree / max(n_tokens, 1),
+        "actionable_agreement": n_sentence_agree / max(len(sentences), 1),
+        "max_score_diff": max_score_diff,
+        "seconds_ref": time_ref,
+        "seconds_test": time_test,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export DeFormer to ONNX and check parity.")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--model", default="Lauler/deformer")
+    parser.add_argument("--out-dir", default="models/deformer-onnx")
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_deformer(args.model, out_dir=args.out_dir, quantize=not args.no_quantize)
+        return
+
+    from transformers import AutoModelForTokenClassification
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, model_max_length=250)
+    model = AutoModelForTokenClassification.from_pretrained(args.model)
+    pipe_ref = pipeline("ner", model=model, tokenizer=tokenizer)
+    pipe_onnx = load_onnx_pipe(args.out_dir, quantized=not args.no_quantize)
+
+    result = parity_check(pipe_ref, pipe_onnx)
+    print(f"Sentences:            {result['n_sentences']}")
+    print(f"Token label agreement: {result['label_agreement']:.2%}")
+    print(f"Actionable agreement:  {result['actionable_agreement']:.2%}")
+    print(f"Max score difference:  {result['max_score_diff']:.4f}")
+    print(f"PyTorch: {result['seconds_ref']:.2f}s, ONNX: {result['seconds_test']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
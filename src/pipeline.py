@@ -0,0 +1,125 @@
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class BoundedPipeline:
+    """
+    Producer/consumer pipeline with a bounded queue. A background thread pulls items from
+    a producer iterable (e.g. the comment trees from fetch_threads) into the queue, and
+    the consuming thread takes them out in batches of whatever is ready (at most
+    max_batch items), so that downloading and inference overlap.
+
+    Keeps track of the queue depth and of how the time of both sides is spent:
+    producer waiting on its iterable (network) or blocked on a full queue, and
+    consumer working on a batch or waiting on an empty queue.
+    """
+
+    def __init__(self, maxsize=8, max_batch=8):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.max_batch = max_batch
+        self.depths = []
+        self.batch_sizes = []
+        self.timings = {
+            "producer_busy": 0.0,
+            "producer_blocked": 0.0,
+            "consumer_busy": 0.0,
+            "consumer_idle": 0.0,
+        }
+        self.error = None
+        self.stop = threading.Event()
+        self.start = None
+        self.end = None
+
+    def _produce(self, iterable):
+        iterator = iter(iterable)
+        try:
+            while not self.stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                put_start = time.perf_counter()
+                self.timings["producer_busy"] += put_start - start
+
+                self.queue.put(item)
+                self.timings["producer_blocked"] += time.perf_counter() - put_start
+        except Exception as e:
+            self.error = e  # Raised in the consuming thread
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()  # E.g. cancel the queued downloads of fetch_threads
+            self.queue.put(_DONE)
+
+    def batches(self, iterable):
+        """
+        Yield lists of produced items until the producer is exhausted.
+        """
+        self.start = time.perf_counter()
+        producer = threading.Thread(target=self._produce, args=(iterable,), daemon=True)
+        producer.start()
+
+        done = False
+        try:
+            while not done:
+                start = time.perf_counter()
+                batch = [self.queue.get()]
+                self.timings["consumer_idle"] += time.perf_counter() - start
+
+                # Take whatever else is ready, without waiting
+                while len(batch) < self.max_batch and batch[-1] is not _DONE:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                self.depths.append(self.queue.qsize() + len(batch))
+                if batch[-1] is _DONE:
+                    batch.pop()
+                    done = True
+
+                if len(batch) > 0:
+                    self.batch_sizes.append(len(batch))
+                    start = time.perf_counter()
+                    yield batch
+                    self.timings["consumer_busy"] += time.perf_counter() - start
+        finally:
+            # If the consumer stopped early, unblock the producer so that it can exit
+            self.stop.set()
+            while not done:
+                done = self.queue.get() is _DONE
+
+            producer.join()
+            self.end = time.perf_counter()
+
+        if self.error is not None:
+            raise self.error
+
+    def summary(self):
+        total = max((self.end or time.perf_counter()) - self.start, 1e-9)
+        depth_mean = sum(self.depths) / max(len(self.depths), 1)
+        lines = [
+            f"Pipeline: {sum(self.batch_sizes)} items in {len(self.batch_sizes)} batches, "
+            f"{total:.2f}s",
+            f"  queue depth   mean {depth_mean:.1f}, max {max(self.depths, default=0)} "
+            f"(capacity {self.queue.maxsize})",
+        ]
+        for name, seconds in self.timings.items():
+            lines.append(f"  {name:<17} {seconds:8.2f}s ({seconds / total:6.1%})")
+
+        # A producer that is often blocked on a full queue means inference is the bottleneck
+        if self.timings["producer_blocked"] > self.timings["consumer_idle"]:
+            lines.append("  bottleneck: consumer (inference)")
+        else:
+            lines.append("  bottleneck: producer (fetch)")
+
+        return "\n".join(lines)
+
+    def log_summary(self):
+        logger.info(self.summary())
@@ -0,0 +1,147 @@
+import re
+import logging
+from collections import Counter
+import pandas as pd
+from .entities import sentence_text
+
+"""
+Suppression rules for DeFormer predictions. Rules are declared once in DEFAULT_RULES and
+compiled by RuleEngine into one word lookup and two combined regexes. Sentence rules are
+applied before inference, word and context rules in a single pass over the entity table
+(see src/entities.py).
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class WordRule:
+    """
+    Suppress entities whose original word (lower cased) is one of words.
+    """
+
+    def __init__(self, name, words):
+        self.name = name
+        self.words = [word.lower() for word in words]
+
+
+class ContextRule:
+    """
+    Suppress entities where pattern matches the lower cased sentence at the entity's start,
+    i.e. the word together with its context to the right.
+    """
+
+    def __init__(self, name, pattern):
+        self.name = name
+        self.pattern = pattern
+
+
+class SentenceRule:
+    """
+    Skip sentences where pattern matches. Applied before inference only (keep_sentence),
+    so that the sentences are never predicted on.
+    """
+
+    def __init__(self, name, pattern):
+        self.name = name
+        self.pattern = pattern
+
+
+DE_SOM_RULE = ContextRule("de_som", r"dem? som")  # We don't want model to predict on "de/dem som"
+DOM_RULE = WordRule("dom", ["dom"])
+# 'de och dem' indicates people discussing the grammar of de vs dem.
+DE_OCH_DEM_RULE = SentenceRule("de_och_dem", r"[Dd]e och dem")
+SINGLE_WORD_RULE = SentenceRule("single_word", r"^\s*\S*\s*$")
+
+DEFAULT_RULES = [DE_SOM_RULE, DOM_RULE, DE_OCH_DEM_RULE, SINGLE_WORD_RULE]
+
+
+def combine_patterns(rules):
+    if len(rules) == 0:
+        return None
+    return re.compile("|".join(f"(?P<{rule.name}>{rule.pattern})" for rule in rules))
+
+
+class RuleEngine:
+    """
+    Applies a list of rules and keeps count of how many entities (or, before inference,
+    sentences) each rule has suppressed.
+    """
+
+    def __init__(self, rules=DEFAULT_RULES):
+        self.rules = rules
+        self.words = {}
+        for rule in rules:
+            if isinstance(rule, WordRule):
+                self.words.update(
+                    {word: rule.name for word in rule.words if word not in self.words}
+                )
+
+        self.context_pattern = combine_patterns([r for r in rules if isinstance(r, ContextRule)])
+        self.sentence_pattern = combine_patterns([r for r in rules if isinstance(r, SentenceRule)])
+        self.hits = Counter()
+
+    def match_sentence(self, sentence):
+        """
+        Name of the first sentence rule matching sentence, or None.
+        """
+        if self.sentence_pattern is None:
+            return None
+        match = self.sentence_pattern.search(sentence)
+        return match.lastgroup if match else None
+
+    def match_entity(self, sentence_lower, start, word):
+        """
+        Name of the first word or context rule suppressing the entity, or None. Sentence
+        rules are only applied before inference (keep_sentence), as lines split from a
+        kept sentence (e.g. a single word line) should keep their predictions.
+        """
+        rule_name = self.words.get(word.lower())
+        if rule_name is None and self.context_pattern is not None:
+            match = self.context_pattern.match(sentence_lower, start)
+            rule_name = match.lastgroup if match else None
+        return rule_name
+
+    def keep_sentence(self, sentence):
+        rule_name = self.match_sentence(sentence)
+        if rule_name is not None:
+            self.hits[rule_name] += 1
+        return rule_name is None
+
+    def filter_entities(self, df_ent, sentences):
+        """
+        Drop suppressed entities from the entity table. sentences: the "sentences" column
+        of the comments the table points to.
+        """
+        texts = sentence_text(df_ent, sentences)
+        rule_names = [
+            self.match_entity(text.lower(), start, word)
+            for text, start, word in zip(texts, df_ent["start"], df_ent["word"])
+        ]
+        rule_names = pd.Series(rule_names, index=df_ent.index, dtype=object)
+
+        hits = rule_names.value_counts()
+        self.hits.update(hits.to_dict())
+        if len(hits) > 0:
+            logger.info(f"Suppressed {hits.sum()} predictions by rule: {hits.to_dict()}")
+
+        return df_ent[rule_names.isna()]
+
+    def filter_preds(self, sentences, preds):
+        """
+        Nested version of filter_entities for a single comment's per sentence predictions.
+        """
+        keep_preds = []
+        for sentence, pred in zip(sentences, preds):
+            keep_pred = []
+            for entity in pred:
+                rule_name = self.match_entity(sentence.lower(), entity["start"], entity["word"])
+                if rule_name is None:
+                    keep_pred.append(entity)
+                else:
+                    self.hits[rule_name] += 1
+            keep_preds.append(keep_pred)
+
+        return keep_preds
+
+    def log_stats(self):
+        logger.info(f"Rule hits since start: {dict(self.hits)}")
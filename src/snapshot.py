@@ -0,0 +1,157 @@
+import os
+import json
+import struct
+import logging
+import argparse
+import torch
+from transformers import (
+    AutoConfig,
+    AutoModelForSeq2SeqLM,
+    AutoModelForTokenClassification,
+    AutoTokenizer,
+    GenerationConfig,
+)
+from transformers.modeling_utils import no_init_weights
+
+"""
+Pinned local model snapshots in safetensors format. Weights are memory mapped from the
+snapshot instead of being copied into memory, so worker processes share the weight pages
+through the OS page cache and loading needs no network lookups.
+"""
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MODELS = {
+    "Lauler/deformer": AutoModelForTokenClassification,
+    "Helsinki-NLP/opus-mt-sv-en": AutoModelForSeq2SeqLM,
+}
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def snapshot_path(model_name, snapshot_dir="models/snapshot"):
+    return os.path.join(snapshot_dir, model_name.replace("/", "--"))
+
+
+def materialize_snapshot(snapshot_dir="models/snapshot", revisions=None):
+    """
+    Download the bot's models (optionally at pinned revisions) and save them with
+    their tokenizers as safetensors in snapshot_dir.
+    """
+    revisions = revisions or {}
+    for model_name, model_cls in SNAPSHOT_MODELS.items():
+        revision = revisions.get(model_name)
+        out_dir = snapshot_path(model_name, snapshot_dir)
+        logger.info(f"Saving {model_name} (revision {revision}) to {out_dir}.")
+
+        model = model_cls.from_pretrained(model_name, revision=revision)
+        tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision)
+        model.save_pretrained(out_dir, safe_serialization=True)
+        tokenizer.save_pretrained(out_dir)
+
+        with open(os.path.join(out_dir, "snapshot.json"), "w") as f:
+            json.dump({"model": model_name, "revision": model.config._commit_hash}, f)
+
+
+def mmap_safetensors(path):
+    """
+    State dict with tensors that are views into a private (copy on write) memory map
+    of a safetensors file.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data = torch.empty(0, dtype=torch.uint8).set_(storage)
+    data_start = 8 + header_size
+
+    state_dict = {}
+    for name, info in header.items():
+        begin, end = info["data_offsets"]
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        tensor_bytes = data[(data_start + begin) : (data_start + end)]
+
+        if (data_start + begin) % tensor_bytes.element_size() != 0:
+            tensor_bytes = tensor_bytes.clone()  # Unaligned, copy instead of viewing
+        state_dict[name] = tensor_bytes.view(dtype).reshape(info["shape"])
+
+    return state_dict
+
+
+def load_snapshot_model(model_cls, path, **config_kwargs):
+    """
+    Build a model without initializing its weights and assign the memory mapped weights.
+    Weights not stored in the file (tied embeddings, sinusoidal positions) are tied or
+    initialized afterwards.
+    """
+    config = AutoConfig.from_pretrained(path, local_files_only=True, **config_kwargs)
+    with no_init_weights():
+        model = model_cls.from_config(config)
+
+    state_dict = mmap_safetensors(os.path.join(path, "model.safetensors"))
+    missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+
+    tied_keys = set(getattr(model, "_tied_weights_keys", None) or [])
+    for key in set(missing) - tied_keys:
+        model._init_weights(model.get_submodule(key.rsplit(".", 1)[0]))
+
+    if len(unexpected) > 0:
+        logger.warning(f"Unexpected weights in snapshot {path}: {unexpected}")
+
+    # Generation settings (beams, max length, ...) are not part of the model config
+    if os.path.exists(os.path.join(path, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(path)
+
+    model.eval()
+    return model
+
+
+def load_snapshot(model_name, snapshot_dir="models/snapshot", **config_kwargs):
+    """
+    Load a model and its tokenizer from a local snapshot created by materialize_snapshot.
+    """
+    path = snapshot_path(model_name, snapshot_dir)
+    model = load_snapshot_model(SNAPSHOT_MODELS[model_name], path, **config_kwargs)
+    tokenizer = AutoTokenizer.from_pretrained(path, local_files_only=True)
+
+    # Keep the hub name and revision, e.g. for the prediction cache key
+    with open(os.path.join(path, "snapshot.json")) as f:
+        snapshot_info = json.load(f)
+    model.config._name_or_path = snapshot_info["model"]
+    model.config._commit_hash = snapshot_info["revision"]
+
+    return model, tokenizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Save the bot's models as a local snapshot.")
+    parser.add_argument("--snapshot-dir", default="models/snapshot")
+    parser.add_argument("--deformer-revision", default=None)
+    parser.add_argument("--translation-revision", default=None)
+    args = parser.parse_args()
+
+    materialize_snapshot(
+        args.snapshot_dir,
+        revisions={
+            "Lauler/deformer": args.deformer_revision,
+            "Helsinki-NLP/opus-mt-sv-en": args.translation_revision,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import os
+import re
+import glob
+import shutil
+import uuid
+import logging
+import argparse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+"""
+Deduplicated storage of comment/submission/all snapshots. Every run appends only rows
+that are new or have changed since they were last stored, to a zstd compressed parquet
+dataset partitioned by day: data/dataset/{type}/snapshot_date=YYYY-MM-DD/*.parquet
+"""
+
+logger = logging.getLogger(__name__)
+
+# Key column and the columns that mark a row as changed, per snapshot type
+SNAPSHOT_KEYS = {
+    "comment": ("id", ["edited", "score"]),
+    "all": ("id", ["edited", "score"]),
+    "submission": ("id_sub", ["num_comments_sub", "score_sub"]),
+    "seen": ("id", ["edited"]),  # All downloaded comments, for delta crawling (src/delta.py)
+}
+
+# HTML versions of text that is already stored as markdown
+DROP_COLUMNS = ["body_html", "selftext_html_sub"]
+
+
+# Unified schema of all files in a dataset. Files starting with "_" are not read as data.
+SCHEMA_FILE = "_schema.parquet"
+
+
+def dataset_schema(path):
+    """
+    Unified schema of the files in a dataset, kept in SCHEMA_FILE so that the schemas of
+    all files are only read once (for datasets written before SCHEMA_FILE existed).
+    """
+    schema_file = os.path.join(path, SCHEMA_FILE)
+    if os.path.exists(schema_file):
+        return pq.read_schema(schema_file)
+
+    files = glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True)
+    if len(files) == 0:
+        return None
+
+    schema = pa.unify_schemas(
+        [pq.read_schema(file) for file in files], promote_options="permissive"
+    )
+    pq.write_table(schema.empty_table(), schema_file)
+    return schema
+
+
+def update_schema(path, schema):
+    """
+    Unify the stored schema of a dataset with the schema of newly written files.
+    """
+    stored_schema = dataset_schema(path)
+    if stored_schema is not None:
+        schema = pa.unify_schemas([stored_schema, schema], promote_options="permissive")
+    pq.write_table(schema.empty_table(), os.path.join(path, SCHEMA_FILE))
+
+
+def read_dataset(path, columns=None, filter=None):
+    """
+    Read a snapshot dataset. Schemas of the files are unified, since columns that
+    were all None in one run (null type) can have values in another.
+    """
+    schema = dataset_schema(path) if os.path.isdir(path) else None
+    if schema is None:
+        return pd.DataFrame()
+
+    dataset = ds.dataset(path, schema=schema, format="parquet", partitioning="hive")
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+
+def latest_versions(df, key):
+    df = df.sort_values("_snapshot", kind="stable")
+    return df.drop_duplicates(key, keep="last").reset_index(drop=True)
+
+
+def isin(column, values):
+    """
+    Filter on a string column, e.g. a key. Typed, so that values can be empty.
+    """
+    return ds.field(column).isin(pa.array(list(values), type=pa.string()))
+
+
+def load_latest(type, root="data/dataset", columns=None, ids=None, filter=None):
+    """
+    Latest stored version of every row (optionally only for the given ids).
+    filter: pyarrow expression selecting the rows to read, e.g. isin("id_sub", id_subs).
+    Should select all versions of a row, i.e. only depend on columns that don't change.
+    """
+    key, _ = SNAPSHOT_KEYS[type]
+    if columns is not None:
+        columns = list(dict.fromkeys([key, "_snapshot"] + columns))
+    if ids is not None:
+        ids_filter = isin(key, ids)
+        filter = ids_filter if filter is None else filter & ids_filter
+
+    df = read_dataset(os.path.join(root, type), columns=columns, filter=filter)
+    if len(df) == 0:
+        return df
+
+    return latest_versions(df, key)
+
+
+def changed_rows(df, type, root="data/dataset"):
+    """
+    Rows of df that are not stored yet, or whose change columns differ from the stored version.
+    """
+    key, change_cols = SNAPSHOT_KEYS[type]
+    df_prev = load_latest(type, root=root, columns=change_cols, ids=df[key])
+
+    if len(df_prev) == 0:
+        return df
+
+    df_prev = df_prev.set_index(key)[change_cols]
+    df_cur = df.set_index(key)[change_cols]
+    is_new = ~df_cur.index.isin(df_prev.index)
+
+    df_prev = df_prev.reindex(df_cur.index)
+    is_changed = ((df_cur != df_prev) & ~(df_cur.isna() & df_prev.isna())).any(axis=1)
+
+    return df[is_new | is_changed.to_numpy()]
+
+
+def write_rows(df, type, date, root="data/dataset"):
+    """
+    Write rows to the partition of date[:10]. Rows without a _snapshot column get date.
+    """
+    df = df.drop(columns=[col for col in DROP_COLUMNS if col in df.columns])
+    if "_snapshot" not in df.columns:
+        df = df.assign(_snapshot=date)
+    df = df.assign(snapshot_date=date[:10]).reset_index(drop=True)
+
+    path = os.path.join(root, type)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=path,
+        partition_cols=["snapshot_date"],
+        compression="zstd",
+        # Unique file names, so that two writes with the same date don't overwrite each other
+        basename_template=f"{date}-{uuid.uuid4().hex[:8]}-{{i}}.parquet",
+    )
+    # The partition column is stored in the directory names, not in the files
+    update_schema(path, table.schema.remove(table.schema.get_field_index("snapshot_date")))
+
+
+def save_snapshot(df, type, date, root="data/dataset"):
+    """
+    Store the new and changed rows of a comment, submission, all or seen dataframe.
+    """
+    try:
+        assert len(df) > 0
+    except AssertionError as e:
+        logger.exception("Dataframe is empty. No incorrect usage of de/dem found.")
+        raise e
+
+    df = df.reset_index(drop=True)
+    if type in ["comment", "all", "seen"]:
+        df["edited"] = df["edited"].astype("int64")
+
+    df_changed = changed_rows(df, type, root=root)
+    logger.info(f"Saving {len(df_changed)} new or changed rows out of {len(df)} to {root}/{type}.")
+
+    if len(df_changed) > 0:
+        write_rows(df_changed, type, date, root=root)
+
+    return df_changed
+
+
+def compact(type, folder=None, root="data/dataset", delete=False):
+    """
+    Fold the old per run feather snapshots (data/{type}/{date}_{type}.feather) into the
+    dataset, and rewrite the dataset keeping only the latest version of every row.
+    """
+    key, _ = SNAPSHOT_KEYS[type]
+    folder = folder or f"data/{type}"
+    files = sorted(glob.glob(os.path.join(folder, f"*_{type}.feather")))
+
+    dfs = []
+    for file in files:
+        date = re.match(rf"(.*)_{type}\.feather", os.path.basename(file)).group(1)
+        df = pd.read_feather(file)
+        dfs.append(df.assign(_snapshot=date))
+
+    df_dataset = read_dataset(os.path.join(root, type))
+    if len(df_dataset) > 0:
+        dfs.append(df_dataset.drop(columns=["snapshot_date"], errors="ignore"))
+
+    if len(dfs) == 0:
+        return pd.DataFrame()
+
+    n_rows = sum(len(df_part) for df_part in dfs)
+    df = latest_versions(pd.concat(dfs, ignore_index=True), key)
+    if type in ["comment", "all", "seen"]:
+        df["edited"] = df["edited"].astype("int64")  # Sometimes int, sometimes boolean in API
+
+    # Write the compacted dataset next to the old one and swap them
+    tmp_root = root + "_compact"
+    shutil.rmtree(os.path.join(tmp_root, type), ignore_errors=True)
+    # One file per day, with the run of every row in the _snapshot column
+    for snapshot_date, df_date in df.groupby(df["_snapshot"].str[:10]):
+        write_rows(df_date, type, snapshot_date, root=tmp_root)
+
+    shutil.rmtree(os.path.join(root, type), ignore_errors=True)
+    os.makedirs(root, exist_ok=True)
+    shutil.move(os.path.join(tmp_root, type), os.path.join(root, type))
+    shutil.rmtree(tmp_root, ignore_errors=True)
+
+    if delete:
+        for file in files:
+            os.remove(file)
+
+    logger.info(
+        f"Compacted {n_rows} rows from {len(files)} feather files and the dataset "
+        f"to {len(df)} rows in {root}/{type}."
+    )
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact snapshot feather files and dataset.")
+    parser.add_argument("--types", nargs="+", default=["comment", "submission", "all", "seen"])
+    parser.add_argument("--root", default="data/dataset")
+    parser.add_argument("--delete", action="store_true", help="Delete folded feather files.")
+    args = parser.parse_args()
+
+    for type in args.types:
+        df = compact(type, root=args.root, delete=args.delete)
+        print(f"{type}: {len(df)} rows")
+
+
+if __name__ == "__main__":
+    main()
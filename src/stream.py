@@ -0,0 +1,121 @@
+import time
+import logging
+import pandas as pd
+from .data import KEEP_COMMENT_COLUMNS, download_submission
+
+"""
+Streaming mode: new comments from subreddit.stream.comments() are analyzed in small
+batches as they arrive, and their reply candidates are kept in a rolling pool that
+choose_post picks from (see run_stream in bot.py).
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def micro_batches(comments, max_size=32, max_wait=10.0):
+    """
+    Group a comment stream into lists of at most max_size comments. A batch is emitted
+    when it is full, or max_wait seconds after its first comment arrived.
+    comments: Stream created with pause_after=0, which yields None whenever there are no
+    new comments. An empty list is then yielded, so that the caller can do other work
+    (e.g. reply, or stop) while the subreddit is quiet.
+    """
+    batch = []
+    first_arrival = None
+    for comment in comments:
+        if comment is not None:
+            if len(batch) == 0:
+                first_arrival = time.monotonic()
+            batch.append(comment)
+
+        if len(batch) >= max_size or (
+            len(batch) > 0 and time.monotonic() - first_arrival >= max_wait
+        ):
+            yield batch
+            batch = []
+        elif comment is None and len(batch) == 0:
+            yield batch
+
+    if len(batch) > 0:
+        yield batch
+
+
+def comment_frame(comments):
+    """
+    Same columns as download_comments, for streamed comments from any thread.
+    """
+    df = pd.DataFrame(
+        [{key: vars(comment).get(key) for key in KEEP_COMMENT_COLUMNS} for comment in comments],
+        columns=KEEP_COMMENT_COLUMNS,
+    )
+    df["id_sub"] = df["link_id"].str[3:]  # link_id is the thread's fullname "t3_<id>"
+
+    # Filter out rows with NaN in body
+    df = df[df["body"].notna()].reset_index(drop=True)
+
+    return df
+
+
+class CandidatePool:
+    """
+    Rolling pool of reply candidates (output of filter_comments) from the comment stream.
+    Candidates are dropped once they are older than max_hours, since choose_post does
+    not reply in threads older than that either.
+    """
+
+    def __init__(self, max_hours=19):
+        self.max_hours = max_hours
+        self.df = None
+
+    def __len__(self):
+        return 0 if self.df is None else len(self.df)
+
+    def add(self, df_candidates):
+        if len(df_candidates) == 0:
+            return
+        df = pd.concat([self.df, df_candidates]) if self.df is not None else df_candidates
+        self.df = df.drop_duplicates("id", keep="last").reset_index(drop=True)
+        logger.info(f"Added {len(df_candidates)} candidates, {len(self)} in pool.")
+
+    def prune(self):
+        if len(self) == 0:
+            return
+        hours_since_post = (time.time() - self.df["created"]) / 3600
+        self.df = self.df[hours_since_post < self.max_hours].reset_index(drop=True)
+
+    def remove_thread(self, link_id):
+        """
+        Don't post twice in same thread.
+        """
+        if len(self) > 0:
+            self.df = self.df[self.df["link_id"] != link_id].reset_index(drop=True)
+
+    def id_subs(self):
+        return [] if self.df is None else self.df["id_sub"].unique().tolist()
+
+
+class SubmissionCache:
+    """
+    Submission info (download_submission) of the threads in the candidate pool. Threads
+    are downloaded again after max_age seconds, since their score, flair and locked
+    status change.
+    """
+
+    def __init__(self, reddit, max_age=600):
+        self.reddit = reddit
+        self.max_age = max_age
+        self.submissions = {}  # id_sub: (download time, df_sub)
+
+    def get(self, id_subs):
+        now = time.monotonic()
+        for id_sub in id_subs:
+            downloaded = self.submissions.get(id_sub)
+            if downloaded is None or now - downloaded[0] > self.max_age:
+                df_sub = download_submission(self.reddit.submission(id_sub))
+                self.submissions[id_sub] = (now, df_sub)
+
+        # Forget threads that are no longer in the pool
+        id_subs = set(id_subs)
+        self.submissions = {k: v for k, v in self.submissions.items() if k in id_subs}
+
+        return pd.concat([df_sub for _, df_sub in self.submissions.values()]).reset_index(drop=True)
@@ -1,4 +1,18 @@
-from .data import filter_de_som, filter_dom
+import re
+import pandas as pd
+from .data import (
+    clean_sentences,
+    filter_comments,
+    filter_de_som,
+    filter_dom,
+    predict_comments,
+    preprocess_comments,
+    predict_dedem,
+    preprocess_stream,
+    rule_engine,
+)
+from .entities import entities_from_preds
+from .inference import predict_batched, predict_sentences, sentence_chunks
 
 sens = [
     "Jag hatar de som är för sämst för de suger dem",
@@ -21,3 +35,129 @@ preds = [
 
 filter_de_som(sens, preds)
 filter_dom(sens, preds)
+
+# Golden output of the sentence preprocessing. preprocess_comments and preprocess_stream
+# should give exactly these sentences per comment body.
+golden = [
+    ("Jag såg dem igår. De var glada!", ["Jag såg dem igår.", "De var glada!"]),
+    ("> Dem kom hem\n\nJag tror att de kom hem.", ["Jag tror att de kom hem."]),
+    ("Hej hej. Ingen här.", []),
+    ("Vi såg de och dem i boken. Dem  är  bra 😀", ["Dem är bra"]),
+    ("de\n\n\nDem kom hem utan punkt\nde gick", ["de", "Dem kom hem utan punkt", "de gick"]),
+    ("Dem* räknas inte.", []),
+]
+
+for body, sentences in golden:
+    assert list(clean_sentences(body)) == sentences, (body, list(clean_sentences(body)))
+
+df_golden = preprocess_comments(pd.DataFrame({"body": [body for body, _ in golden]}))
+assert df_golden["sentences"].tolist() == [sens for _, sens in golden if len(sens) > 0]
+
+stream = preprocess_stream({"body": body} for body, _ in golden)
+assert [sens for _, sens in stream] == [sens for _, sens in golden if len(sens) > 0]
+
+# A batch where no comment has a de/dem sentence left after preprocessing should give
+# no candidates (without calling the model).
+df_none = pd.DataFrame(
+    {"body": ["Hej hej. Ingen här.", "Dem* räknas inte."], "author": None, "subreddit": None}
+)
+df_none = preprocess_comments(df_none)
+assert len(df_none) == 0
+df_none, df_ent_none = predict_comments(df_none, pipe=None, threshold=0.985)
+assert len(df_ent_none) == 0
+assert len(filter_comments(df_none, df_ent_none)) == 0
+
+# Sentence rules (single word, "de och dem") only skip sentences before inference. A single
+# word line, split from a longer sentence, keeps its predictions.
+assert not rule_engine.keep_sentence("dem")
+assert not rule_engine.keep_sentence("Ska det vara de och dem?")
+sens_lines = pd.Series([["de", "Dem kom hem", "Jag såg de som kom"]])
+df_ent_lines = entities_from_preds(
+    [
+        [
+            [{"start": 0, "end": 2, "word": "de", "entity": "DEM", "score": 0.99}],
+            [{"start": 0, "end": 3, "word": "dem", "entity": "DE", "score": 0.99}],
+            [{"start": 8, "end": 10, "word": "de", "entity": "DEM", "score": 0.99}],
+        ]
+    ]
+)
+df_ent_lines = rule_engine.filter_entities(df_ent_lines, sens_lines)
+assert df_ent_lines["sentence_idx"].tolist() == [0, 1]  # Only "de som" is suppressed
+
+
+class WhitespaceTokenizer:
+    model_max_length = 512
+
+    def num_special_tokens_to_add(self):
+        return 0
+
+    def __call__(self, sentences, add_special_tokens=False, return_offsets_mapping=True):
+        return {"offset_mapping": [[m.span() for m in re.finditer(r"\S+", s)] for s in sentences]}
+
+
+class SwapPipe:
+    """
+    Stand-in for DeFormer that predicts every de as DEM, and every dem and det as DE.
+    """
+
+    tokenizer = WhitespaceTokenizer()
+
+    def __call__(self, sentences, batch_size=1):
+        swap = {"de": "DEM", "dem": "DE", "det": "DE"}
+        return [
+            [
+                {
+                    "entity": swap.get(m.group(), "ord"),
+                    "score": 0.99,
+                    "word": m.group(),
+                    "start": m.start(),
+                    "end": m.end(),
+                }
+                for m in re.finditer(r"\w+", sentence)
+            ]
+            for sentence in sentences
+        ]
+
+
+# predict_dedem and the batched prediction of the live pipeline give the same predictions,
+# also for lines without de/dem (split from a sentence with de/dem)
+sens_swap = list(clean_sentences("Jag såg De igår. Dem kom hem\nDet var kul"))
+assert sens_swap == ["Jag såg De igår.", "Dem kom hem", "Det var kul"]
+preds_swap = predict_dedem(sens_swap, SwapPipe())
+assert preds_swap == predict_batched([sens_swap], SwapPipe())[0]
+assert [[d["word"] for d in pred] for pred in preds_swap] == [["de"], ["dem"], ["det"]]
+
+
+class SubwordTokenizer(WhitespaceTokenizer):
+    """
+    Splits words into pieces of at most 3 characters, like ##subword tokens.
+    """
+
+    model_max_length = 8
+
+    def __call__(self, sentences, add_special_tokens=False, return_offsets_mapping=True):
+        return {
+            "offset_mapping": [[m.span() for m in re.finditer(r"\S{1,3}", s)] for s in sentences]
+        }
+
+
+class ChunkedSwapPipe(SwapPipe):
+    tokenizer = SubwordTokenizer()
+
+
+# Sentences longer than model_max_length are predicted in overlapping chunks, and the
+# merged predictions are the same as for the whole sentence: no entity is dropped or
+# duplicated at the chunk boundaries
+long_sentence = " ".join(["Jag gav dem en lapp om fuktskadan men de har inte svarat."] * 4)
+long_offsets = ChunkedSwapPipe.tokenizer([long_sentence])["offset_mapping"][0]
+assert len(long_offsets) > SubwordTokenizer.model_max_length
+for stride in [0, 1, 3, 5]:
+    chunks = sentence_chunks(long_offsets, max_tokens=8, stride=stride)
+    assert len(chunks) > 1
+    assert chunks[0][2] == 0 and chunks[-1][3] == len(long_sentence)
+    assert all(prev[3] == next[2] for prev, next in zip(chunks, chunks[1:]))
+
+    preds_chunked = predict_sentences(
+        ["Dem kom hem", long_sentence], ChunkedSwapPipe(), batch_size=2, stride=stride
+    )
+    assert preds_chunked == SwapPipe()(["Dem kom hem", long_sentence])
@@ -0,0 +1,71 @@
+import time
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """
+    Accumulate wall clock time and item counts per pipeline stage.
+    """
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def timed(self, name, iterable):
+        """
+        Time only the time spent waiting on the iterable (e.g. a download generator),
+        not the work done by the caller between items.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.timings[name] += time.perf_counter() - start
+                return
+            self.timings[name] += time.perf_counter() - start
+            yield item
+
+    def count(self, name, n):
+        self.counts[name] += n
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        total = self.total()
+        lines = [f"Total: {total:.2f}s"]
+        for name, seconds in self.timings.items():
+            lines.append(f"  {name:<12} {seconds:8.2f}s ({seconds / total:6.1%})")
+
+        if self.counts["comments"] > 0:
+            lines.append(f"  comments/s   {self.counts['comments'] / total:8.1f}")
+        if self.counts["comments"] > 0 and "prefiltered" in self.counts:
+            rejected = 1 - self.counts["prefiltered"] / self.counts["comments"]
+            lines.append(f"  prefilter rejected {rejected:6.1%} of comments")
+        if self.counts["sentences"] > 0 and self.timings["predict"] > 0:
+            lines.append(
+                f"  sentences/s  {self.counts['sentences'] / self.timings['predict']:8.1f}"
+                " (prediction stage)"
+            )
+        for name, n in self.counts.items():
+            lines.append(f"  {name:<12} {n:8d}")
+
+        return "\n".join(lines)
+
+    def log_summary(self):
+        logger.info("Stage timings:\n" + self.summary())
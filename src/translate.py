@@ -1,12 +1,49 @@
 import re
 import logging
-import matplotlib.pyplot as plt
-from .utils import heatmap, annotate_heatmap
+import torch
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, BatchEncoding
 from .comment import match_case
+from .snapshot import load_snapshot
 
 logger = logging.getLogger(__name__)
 
 
+def load_translation_model(
+    model_name="Helsinki-NLP/opus-mt-sv-en",
+    device=torch.device("cpu"),
+    quantize=False,
+    snapshot_dir=None,
+):
+    """
+    Load the Marian translation model and tokenizer.
+    quantize: Apply dynamic int8 quantization to the linear layers (CPU only).
+    Attention weights are still returned, so the de/dem alignment works as before.
+    snapshot_dir: Memory map the weights from a local snapshot (see src/snapshot.py).
+    """
+    if snapshot_dir is not None:
+        model_translate, tokenizer_translate = load_snapshot(
+            model_name, snapshot_dir, output_attentions=True
+        )
+    else:
+        tokenizer_translate = AutoTokenizer.from_pretrained(model_name)
+        model_translate = AutoModelForSeq2SeqLM.from_pretrained(
+            model_name, output_attentions=True
+        )
+    model_translate.eval()
+
+    if quantize and device.type == "cpu":
+        logger.info(f"Quantizing {model_name} to dynamic int8.")
+        model_translate = torch.ao.quantization.quantize_dynamic(
+            model_translate, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    elif quantize:
+        logger.warning("Dynamic int8 quantization is only supported on CPU. Using fp32 model.")
+
+    model_translate.to(device)
+
+    return model_translate, tokenizer_translate
+
+
 def get_cross_attention(outputs, layer=-1):
     """
     Average cross attentions over all attention heads in a specific layer
@@ -63,6 +100,18 @@ def correct_sen(preds, sentences):
     return out_dict
 
 
+def remove_generated_padding(output_ids, eos_token_id):
+    """
+    Cut a generated sequence from a batch after its end of sentence token, so that it
+    has the same shape (1, length) as when the sentence is generated on its own.
+    """
+    eos_positions = (output_ids == eos_token_id).nonzero()
+    if len(eos_positions) > 0:
+        output_ids = output_ids[: (eos_positions[0].item() + 1)]
+
+    return output_ids.unsqueeze(0)
+
+
 def get_translation_tokens(swedish_pipe, model_translate, tokenizer_translate, device):
     """
     Get token ids and tokens in both Swedish and English to build a similar output to Huggingface's
@@ -88,27 +137,42 @@ def get_translation_tokens(swedish_pipe, model_translate, tokenizer_translate, d
             }
     """
 
+    sentences = swedish_pipe["corrected_sentences"]
+    model_translate.eval()
+
     tokenized_sens_sv = []
     tokens_sv = []
-    for sentence in swedish_pipe["corrected_sentences"]:
-        tokenized_sens_sv.append(
-            tokenizer_translate(sentence, return_tensors="pt").to(device)
-        )  # ids
-        tokens_sv.append(
-            tokenizer_translate.convert_ids_to_tokens(tokenized_sens_sv[-1].input_ids[0])
-        )  # tokens
-
     tokenized_sens_en = []
     decoded_sens_en = []
     tokens_en = []
-    model_translate.eval()
 
-    for tok_sen in tokenized_sens_sv:
-        tokenized_sens_en.append(model_translate.generate(**tok_sen))
-        decoded_sens_en.append(
-            tokenizer_translate.batch_decode(tokenized_sens_en[-1], skip_special_tokens=True)[0]
-        )
-        tokens_en.append(tokenizer_translate.convert_ids_to_tokens(tokenized_sens_en[-1][0]))
+    if len(sentences) > 0:
+        # Translate all sentences of the post in one padded batch
+        batch = tokenizer_translate(sentences, return_tensors="pt", padding=True).to(device)
+        generated = model_translate.generate(**batch)
+
+        for i in range(len(sentences)):
+            # Remove padding so every sentence looks like it was tokenized and translated alone
+            mask = batch.attention_mask[i].bool()
+            tokenized_sens_sv.append(
+                BatchEncoding(
+                    {
+                        "input_ids": batch.input_ids[i][mask].unsqueeze(0),
+                        "attention_mask": batch.attention_mask[i][mask].unsqueeze(0),
+                    }
+                )
+            )  # ids
+            tokens_sv.append(
+                tokenizer_translate.convert_ids_to_tokens(tokenized_sens_sv[-1].input_ids[0])
+            )  # tokens
+
+            tokenized_sens_en.append(
+                remove_generated_padding(generated[i], tokenizer_translate.eos_token_id)
+            )
+            decoded_sens_en.append(
+                tokenizer_translate.batch_decode(tokenized_sens_en[-1], skip_special_tokens=True)[0]
+            )
+            tokens_en.append(tokenizer_translate.convert_ids_to_tokens(tokenized_sens_en[-1][0]))
 
     swedish_pipe["token_sentences"] = tokens_sv
     swedish_pipe["outputs"] = tokenized_sens_sv
@@ -202,26 +266,27 @@ def decoder_pred_pipe(pipes, model_translate):
     en_pred_pipes = []
 
     for i, preds in enumerate(sv_pipe["pred_pipe"]):
-        en_pred_pipe = []
+        if len(preds) == 0:
+            en_pred_pipes.append([])
+            continue
 
-        for j, pred_token in enumerate(preds):
+        # One forward pass per sentence, shared by all de/dem predictions in the sentence
+        with torch.no_grad():
             outputs = model_translate(
                 input_ids=sv_pipe["outputs"][i].input_ids,
                 decoder_input_ids=en_pipe["outputs"][i],
                 output_hidden_states=True,
             )
 
-            cross_attention = get_cross_attention(outputs, layer=0)
-
-            # Index within sentence for incorrect de/dem token
-            dedem_index_sv = pred_token["index"]
-            # Which English token does de/dem attend to the most?
-            index_en = cross_attention[dedem_index_sv - 1, 1:-1].argmax()
+        cross_attention = get_cross_attention(outputs, layer=0)
 
-            # Add 1 to index because pytorch matrix index starts count from 0
-            en_pred_pipe.append(en_pipe["pipe"][i][index_en + 1])
+        # Indices within sentence for incorrect de/dem tokens
+        dedem_indices_sv = torch.tensor([pred_token["index"] for pred_token in preds]) - 1
+        # Which English token does each de/dem attend to the most?
+        indices_en = cross_attention[dedem_indices_sv, 1:-1].argmax(dim=1)
 
-        en_pred_pipes.append(en_pred_pipe)
+        # Add 1 to index because pytorch matrix index starts count from 0
+        en_pred_pipes.append([en_pipe["pipe"][i][index_en + 1] for index_en in indices_en.tolist()])
 
     en_pipe["pred_pipe"] = en_pred_pipes
 
@@ -229,6 +294,9 @@ def decoder_pred_pipe(pipes, model_translate):
 
 
 def visualize_attention(pipes, model_translate, sen_nr=0):
+    # Plotting libraries are only imported when needed, to keep bot startup fast
+    import matplotlib.pyplot as plt
+    from .utils import heatmap, annotate_heatmap
 
     outputs = model_translate(
         input_ids=pipes[0]["outputs"][sen_nr].input_ids,